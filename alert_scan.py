@@ -0,0 +1,183 @@
+from collections import defaultdict
+import numpy as np
+from archive import reading_sources
+from vitals import READING_FIELDS
+from rules import rule_engine, rule_conditions, CompiledRules, validate_rule
+from clinical import load_clinical_contexts
+
+# Retrospective alert scan: re-runs the clinical rules over stored health_data and
+# reports alert episodes (consecutive readings of one patient that fire the same
+# rule, with no more than SCAN_MAX_GAP seconds between them). Columns are fetched
+# in bulk and evaluated as NumPy arrays, one comparison per distinct predicate
+# per rule group instead of one Python call per row.
+#
+# Medication contexts are the patients' *current* clinical info; historical
+# changes to patient_clinical_info are not tracked.
+
+SCAN_FETCH_SIZE = 200000
+SCAN_MAX_EPISODES = 100
+# Seconds; three 5-minute reading intervals. A longer silence ends the episode
+SCAN_MAX_GAP = 900
+
+_COMPARE = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+}
+
+_COLUMNS = ', '.join(f"CAST(COALESCE({field}, 0) AS REAL)" for field in READING_FIELDS)
+
+
+def fetch_columns(conn, patient_ids=None, start=None, end=None):
+    """Return (user_id, epoch_seconds, {field: values}) arrays ordered by patient and time."""
+    where = []
+    params = []
+    if patient_ids:
+        where.append(f"user_id IN ({','.join('?' * len(patient_ids))})")
+        params.extend(patient_ids)
+    if start:
+        where.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        where.append("timestamp < ?")
+        params.append(end)
+    chunks = []
+    for table, source_where, source_params in reading_sources(conn, start, end):
+        conditions = where + ([source_where] if source_where else [])
+        cursor = conn.execute(f"""
+            SELECT user_id, CAST(strftime('%s', timestamp) AS REAL), {_COLUMNS}
+            FROM {table}
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY user_id, timestamp, id
+        """, params + source_params)
+        while True:
+            rows = cursor.fetchmany(SCAN_FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    data = np.concatenate(chunks) if chunks else np.empty((0, 2 + len(READING_FIELDS)))
+    # Sources come oldest first; a stable sort puts each patient's readings
+    # back together without reordering equal timestamps
+    data = data[np.lexsort((data[:, 1], data[:, 0]))]
+    columns = {field: data[:, 2 + i] for i, field in enumerate(READING_FIELDS)}
+    return data[:, 0].astype(np.int64), data[:, 1], columns
+
+
+def _evaluate_rule(rule, columns, context, predicate_cache):
+    def predicate(field, op, value):
+        key = (field, op, value)
+        if key not in predicate_cache:
+            predicate_cache[key] = _COMPARE[op](columns[field], value)
+        return predicate_cache[key]
+
+    length = len(next(iter(columns.values())))
+    if rule.get('when') and rule['when'] not in context:
+        return np.zeros(length, dtype=bool)
+    fired = np.ones(length, dtype=bool)
+    for field, op, value in rule_conditions(rule, 'all'):
+        fired &= predicate(field, op, value)
+    any_conditions = rule_conditions(rule, 'any')
+    if any_conditions:
+        matched = np.zeros(length, dtype=bool)
+        for field, op, value in any_conditions:
+            matched |= predicate(field, op, value)
+        fired &= matched
+    return fired
+
+
+def scan(conn, patient_ids=None, start=None, end=None, rules=None, max_episodes=SCAN_MAX_EPISODES,
+         max_gap=SCAN_MAX_GAP):
+    """Re-run the alert rules over stored readings.
+
+    rules, when given, is a list of rule definitions to audit instead of the
+    configured ones (per-patient overrides are then ignored).
+    """
+    if rules is not None:
+        candidate = CompiledRules([validate_rule(rule) for rule in rules])
+    user_ids, timestamps, columns = fetch_columns(conn, patient_ids, start, end)
+    total = len(user_ids)
+
+    # Patients that share a rule set and a medication context are evaluated together
+    patients = np.unique(user_ids)
+    contexts = load_clinical_contexts(conn, patients.tolist())
+    groups = defaultdict(list)
+    for pid in patients.tolist():
+        compiled = candidate if rules is not None else rule_engine.rules_for(pid)
+        groups[(id(compiled), contexts[pid])].append((pid, compiled))
+
+    fired = {}
+    rule_meta = {}
+    for (_, context), members in groups.items():
+        compiled = members[0][1]
+        rows = np.flatnonzero(np.isin(user_ids, [pid for pid, _ in members]))
+        sub_columns = {field: values[rows] for field, values in columns.items()}
+        predicate_cache = {}
+        for rule in compiled.rules:
+            hits = _evaluate_rule(rule, sub_columns, context, predicate_cache)
+            if not hits.any():
+                continue
+            if rule['id'] not in fired:
+                fired[rule['id']] = np.zeros(total, dtype=bool)
+                rule_meta[rule['id']] = {'type': rule['type'], 'msg': rule['msg']}
+            fired[rule['id']][rows[hits]] = True
+
+    # An episode is a run of consecutive firing readings of the same patient,
+    # each within max_gap seconds of the one before
+    same_patient = np.zeros(total, dtype=bool)
+    linked = np.zeros(total, dtype=bool)
+    if total:
+        same_patient[1:] = user_ids[1:] == user_ids[:-1]
+        linked[1:] = same_patient[1:] & (np.diff(timestamps) <= max_gap)
+    report = {
+        int(pid): {'patient_id': int(pid), 'readings': 0, 'rules': {}, 'episodes': []}
+        for pid in patients.tolist()
+    }
+    if total:
+        first_rows = np.flatnonzero(~same_patient)
+        counts = np.diff(np.append(first_rows, total))
+        for row, count in zip(first_rows.tolist(), counts.tolist()):
+            report[int(user_ids[row])]['readings'] = count
+
+    for rule_id, hits in fired.items():
+        continued = np.zeros(total, dtype=bool)
+        continued[1:] = hits[:-1] & linked[1:]
+        starts = np.flatnonzero(hits & ~continued)
+        following = np.zeros(total, dtype=bool)
+        following[:-1] = hits[1:] & linked[1:]
+        ends = np.flatnonzero(hits & ~following)
+        durations = timestamps[ends] - timestamps[starts]
+        lengths = ends - starts + 1
+        episode_patients = user_ids[starts]
+        for pid in np.unique(episode_patients).tolist():
+            mine = np.flatnonzero(episode_patients == pid)
+            entry = report[int(pid)]
+            entry['rules'][rule_id] = dict(
+                rule_meta[rule_id],
+                episodes=int(len(mine)),
+                readings=int(lengths[mine].sum()),
+                duration_seconds=int(durations[mine].sum()),
+                longest_seconds=int(durations[mine].max())
+            )
+            for i in mine[:max_episodes].tolist():
+                entry['episodes'].append({
+                    'rule': rule_id,
+                    'type': rule_meta[rule_id]['type'],
+                    'start': _iso(timestamps[starts[i]]),
+                    'end': _iso(timestamps[ends[i]]),
+                    'readings': int(lengths[i]),
+                    'duration_seconds': int(durations[i])
+                })
+
+    for entry in report.values():
+        entry['episodes'].sort(key=lambda e: (e['start'], e['rule']))
+    return {
+        'from': start,
+        'to': end,
+        'readings': int(total),
+        'patients': list(report.values())
+    }
+
+
+def _iso(epoch_seconds):
+    return np.datetime_as_string(np.datetime64(int(epoch_seconds), 's')).replace('T', ' ')
@@ -1,37 +1,89 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response
-import os
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, flash
 import secrets
-from db import init_db, get_db_connection
+from db import init_db, init_app, get_db
+import metrics
+from vitals import parse_reading, insert_readings, publish_readings
+from clinical import invalidate_clinical_context
+from pagination import PAGE_SIZE, decode_cursor, split_page
+from associations import association_index
+from app_logging import configure_logging, get_logger
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
+init_app(app)
+metrics.init_app(app)
 
 # Initialize Database and Logs on Start
 with app.app_context():
     init_db()
-    logs_dir = os.path.join(os.path.dirname(__file__), 'logs')
-    if not os.path.exists(logs_dir):
-        os.makedirs(logs_dir)
+configure_logging()
+auth_log = get_logger('auth')
 
-from routes_api import api_bp
+from routes_api import api_bp, can_view_patient
 from routes_admin import admin_bp
 app.register_blueprint(api_bp)
 app.register_blueprint(admin_bp)
 
-from werkzeug.security import check_password_hash
+from passwords import PoolBusy, PASSWORD_RETRY_AFTER, verify_and_upgrade
+from user_directory import username_key, get_user_profile
 from auth_utils import login_required, roles_required, redirect_if_logged_in
 
+@app.before_request
+def refresh_session_user():
+    # The session cookie carries role and name from login time; keep them in step
+    # with the users row (cached) so role changes and deleted accounts take effect
+    user_id = session.get('user_id')
+    if user_id is None:
+        return
+    profile = get_user_profile(user_id)
+    if profile is None:
+        session.clear()
+        return
+    for key, value in profile.items():
+        if session.get(key) != value:
+            session[key] = value
+
+def visit_notes_page(conn, patient_id, cursor=None):
+    """One page of a patient's visit notes, newest first, plus the cursor of the next page."""
+    if cursor is None:
+        rows = conn.execute("""
+            SELECT vn.*, u.full_name as worker_name
+            FROM visit_notes vn
+            JOIN users u ON vn.worker_id = u.id
+            WHERE vn.patient_id = ?
+            ORDER BY vn.timestamp DESC, vn.id DESC
+            LIMIT ?
+        """, (patient_id, PAGE_SIZE + 1)).fetchall()
+    else:
+        timestamp, note_id = decode_cursor(cursor, 2)
+        rows = conn.execute("""
+            SELECT vn.*, u.full_name as worker_name
+            FROM visit_notes vn
+            JOIN users u ON vn.worker_id = u.id
+            WHERE vn.patient_id = ? AND (vn.timestamp, vn.id) < (?, ?)
+            ORDER BY vn.timestamp DESC, vn.id DESC
+            LIMIT ?
+        """, (patient_id, timestamp, note_id, PAGE_SIZE + 1)).fetchall()
+    return split_page(rows, PAGE_SIZE, lambda row: (row['timestamp'], row['id']))
+
+def assigned_patients_of(conn, monitor_id):
+    patient_ids = sorted(association_index.patients_of(monitor_id))
+    return conn.execute(f"""
+        SELECT u.id, u.full_name, pl.timestamp as last_seen
+        FROM users u
+        LEFT JOIN patient_latest pl ON pl.patient_id = u.id
+        WHERE u.id IN ({','.join('?' * len(patient_ids))})
+        ORDER BY u.id
+    """, patient_ids).fetchall()
+
 @app.route('/')
 @login_required
 def home():
     role = session.get('role')
     username = session.get('username')
     
-    # Detailed logging for debugging role redirection
-    log_path = os.path.join(os.path.dirname(__file__), 'logs', 'auth_debug.log')
-    with open(log_path, 'a') as f:
-        import datetime
-        f.write(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Home access: user={username}, role={role}\n")
+    # Detailed logging for debugging role redirection (DEBUG level: the hottest route)
+    auth_log.debug('Home access', extra={'fields': {'user': username, 'role': role}})
 
     if role == 'admin':
         return redirect(url_for('admin.index'))
@@ -52,11 +104,17 @@ def login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '')
 
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE LOWER(username) = LOWER(?)', (username,)).fetchone()
-        conn.close()
+        conn = get_db()
+        user = conn.execute('SELECT * FROM users WHERE username_key = ?', (username_key(username),)).fetchone()
+
+        try:
+            verified = user is not None and verify_and_upgrade(conn, user, password)
+        except PoolBusy as e:
+            response = Response(render_template('login.html', error=str(e)), status=503)
+            response.headers['Retry-After'] = str(PASSWORD_RETRY_AFTER)
+            return response
 
-        if user and check_password_hash(user['password'], password):
+        if verified:
             # Clear old session data before setting new user data
             session.clear()
             session['user_id'] = user['id']
@@ -64,19 +122,12 @@ def login():
             session['role'] = user['role']
             session['full_name'] = user['full_name']
             
-            # Logging (porting from login.php update)
-            log_path = os.path.join(os.path.dirname(__file__), 'logs', 'auth_debug.log')
-            with open(log_path, 'a') as f:
-                import datetime
-                f.write(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Login successful for: {username}\n")
+            auth_log.info('Login successful', extra={'fields': {'user': username}})
             
             return redirect(url_for('home'))
         else:
             reason = "User not found" if not user else "Password mismatch"
-            log_path = os.path.join(os.path.dirname(__file__), 'logs', 'auth_debug.log')
-            with open(log_path, 'a') as f:
-                import datetime
-                f.write(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Login failed for: {username} ({reason})\n")
+            auth_log.info('Login failed', extra={'fields': {'user': username, 'reason': reason}})
             error = "Invalid username or password."
 
     return render_template('login.html', error=error)
@@ -95,31 +146,28 @@ def admin_redirect():
 @app.route('/patient')
 @roles_required('patient')
 def patient_dashboard():
-    conn = get_db_connection()
+    conn = get_db()
     meds = conn.execute('SELECT * FROM medication_alerts WHERE user_id = ? AND taken = 0 ORDER BY time ASC', (session['user_id'],)).fetchall()
     doc_reminders = conn.execute('SELECT * FROM doctor_reminders WHERE user_id = ? AND status = "pending" ORDER BY date ASC, time ASC', (session['user_id'],)).fetchall()
     clinical_info = conn.execute("SELECT * FROM patient_clinical_info WHERE patient_id = ?", (session['user_id'],)).fetchone()
-    conn.close()
     return render_template('patient/index.html', medication_alerts=meds, clinical_info=clinical_info, doctor_reminders=doc_reminders)
 
 @app.route('/patient/care_team')
 @roles_required('patient')
 def care_team():
-    conn = get_db_connection()
-    members = conn.execute("""
-        SELECT u.id, u.full_name, u.role, ua.id as association_id
-        FROM users u
-        JOIN user_associations ua ON u.id = ua.monitor_id
-        WHERE ua.patient_id = ?
-    """, (session['user_id'],)).fetchall()
-    conn.close()
+    conn = get_db()
+    monitor_ids = sorted(association_index.monitors_of(session['user_id']))
+    members = conn.execute(f"""
+        SELECT id, full_name, role FROM users
+        WHERE id IN ({','.join('?' * len(monitor_ids))})
+    """, monitor_ids).fetchall()
     return render_template('patient/care_team.html', care_team=members)
 
 @app.route('/nurse', methods=['GET', 'POST'])
 @roles_required('home_nurse')
 def nurse_dashboard():
     view_user_id = request.args.get('user_id')
-    conn = get_db_connection()
+    conn = get_db()
     
     if request.method == 'POST':
         action = request.form.get('action')
@@ -131,18 +179,16 @@ def nurse_dashboard():
             conn.execute("INSERT OR REPLACE INTO patient_clinical_info (patient_id, diseases, doctors, medications, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
                          (request.form['patient_id'], request.form['diseases'], request.form['doctors'], request.form['medications']))
             conn.commit()
+            invalidate_clinical_context(request.form['patient_id'])
         elif action == 'add_vitals':
-            conn.execute("""
-                INSERT INTO health_data (user_id, heart_rate, blood_pressure_sys, blood_pressure_dia, oxygen_level, temperature, sugar_level)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (request.form['patient_id'], 
-                  request.form['heart_rate'], 
-                  request.form['blood_pressure_sys'],
-                  request.form['blood_pressure_dia'],
-                  request.form['oxygen_level'], 
-                  request.form['temperature'], 
-                  request.form['sugar_level']))
+            try:
+                row = parse_reading(dict(request.form.to_dict(), user_id=request.form['patient_id']))
+            except ValueError as e:
+                flash(f"Error: {str(e)}")
+                return redirect(url_for('nurse_dashboard', user_id=request.form['patient_id']))
+            insert_readings(conn, [row])
             conn.commit()
+            publish_readings([row])
         elif action == 'add_med':
             conn.execute("INSERT INTO medication_alerts (user_id, med_name, dosage, time) VALUES (?, ?, ?, ?)", 
                          (request.form['patient_id'], request.form['med_name'], request.form['dosage'], request.form['time']))
@@ -156,45 +202,33 @@ def nurse_dashboard():
         return redirect(url_for('nurse_dashboard', user_id=request.form['patient_id']))
 
     # Fetch assigned patients
-    assigned_patients = conn.execute("""
-        SELECT u.id, u.full_name, MAX(hd.timestamp) as last_seen 
-        FROM users u
-        JOIN user_associations ua ON u.id = ua.patient_id
-        LEFT JOIN health_data hd ON u.id = hd.user_id
-        WHERE ua.monitor_id = ?
-        GROUP BY u.id
-    """, (session['user_id'],)).fetchall()
+    assigned_patients = assigned_patients_of(conn, session['user_id'])
 
     clinical_info = None
     medication_alerts = []
     doctor_reminders = []
     observation_history = []
+    notes_cursor = None
     if view_user_id:
         clinical_info = conn.execute("SELECT * FROM patient_clinical_info WHERE patient_id = ?", (view_user_id,)).fetchone()
         medication_alerts = conn.execute("SELECT * FROM medication_alerts WHERE user_id = ? AND taken = 0 ORDER BY time ASC", (view_user_id,)).fetchall()
         doctor_reminders = conn.execute("SELECT * FROM doctor_reminders WHERE user_id = ? AND status = 'pending' ORDER BY date ASC, time ASC", (view_user_id,)).fetchall()
-        observation_history = conn.execute("""
-            SELECT vn.*, u.full_name as worker_name 
-            FROM visit_notes vn 
-            JOIN users u ON vn.worker_id = u.id 
-            WHERE vn.patient_id = ? 
-            ORDER BY vn.timestamp DESC
-        """, (view_user_id,)).fetchall()
+        observation_history, notes_cursor = visit_notes_page(conn, view_user_id)
 
-    conn.close()
     return render_template('nurse/index.html', 
                            assigned_patients=assigned_patients,
                            view_user_id=view_user_id,
                            clinical_info=clinical_info,
                            medication_alerts=medication_alerts,
                            doctor_reminders=doctor_reminders,
-                           observation_history=observation_history)
+                           observation_history=observation_history,
+                           notes_cursor=notes_cursor)
 
 @app.route('/worker', methods=['GET', 'POST'])
 @roles_required('migrant_worker')
 def worker_dashboard():
     view_user_id = request.args.get('user_id')
-    conn = get_db_connection()
+    conn = get_db()
     
     if request.method == 'POST':
         action = request.form.get('action')
@@ -204,66 +238,57 @@ def worker_dashboard():
             conn.commit()
         return redirect(url_for('worker_dashboard', user_id=request.form['patient_id']))
 
-    assigned_patients = conn.execute("""
-        SELECT u.id, u.full_name, MAX(hd.timestamp) as last_seen 
-        FROM users u
-        JOIN user_associations ua ON u.id = ua.patient_id
-        LEFT JOIN health_data hd ON u.id = hd.user_id
-        WHERE ua.monitor_id = ?
-        GROUP BY u.id
-    """, (session['user_id'],)).fetchall()
+    assigned_patients = assigned_patients_of(conn, session['user_id'])
 
     observation_history = []
+    notes_cursor = None
     if view_user_id:
-        observation_history = conn.execute("""
-            SELECT vn.*, u.full_name as worker_name 
-            FROM visit_notes vn 
-            JOIN users u ON vn.worker_id = u.id 
-            WHERE vn.patient_id = ? 
-            ORDER BY vn.timestamp DESC
-        """, (view_user_id,)).fetchall()
+        observation_history, notes_cursor = visit_notes_page(conn, view_user_id)
 
-    conn.close()
     return render_template('worker/index.html', 
                            assigned_patients=assigned_patients,
                            view_user_id=view_user_id,
-                           observation_history=observation_history)
+                           observation_history=observation_history,
+                           notes_cursor=notes_cursor)
 
 @app.route('/caregiver', methods=['GET', 'POST'])
 @roles_required('caregiver')
 def caregiver_dashboard():
     # Exactly same as worker logic for this app
     view_user_id = request.args.get('user_id')
-    conn = get_db_connection()
+    conn = get_db()
     if request.method == 'POST':
         conn.execute("INSERT INTO visit_notes (patient_id, worker_id, note) VALUES (?, ?, ?)",
                      (request.form['patient_id'], session['user_id'], request.form['note']))
         conn.commit()
         return redirect(url_for('caregiver_dashboard', user_id=request.form['patient_id']))
 
-    assigned_patients = conn.execute("""
-        SELECT u.id, u.full_name, MAX(hd.timestamp) as last_seen 
-        FROM users u
-        JOIN user_associations ua ON u.id = ua.patient_id
-        LEFT JOIN health_data hd ON u.id = hd.user_id
-        WHERE ua.monitor_id = ?
-        GROUP BY u.id
-    """, (session['user_id'],)).fetchall()
+    assigned_patients = assigned_patients_of(conn, session['user_id'])
 
     observation_history = []
+    notes_cursor = None
     if view_user_id:
-        observation_history = conn.execute("""
-            SELECT vn.*, u.full_name as worker_name 
-            FROM visit_notes vn 
-            JOIN users u ON vn.worker_id = u.id 
-            WHERE vn.patient_id = ? 
-            ORDER BY vn.timestamp DESC
-        """, (view_user_id,)).fetchall()
-    conn.close()
+        observation_history, notes_cursor = visit_notes_page(conn, view_user_id)
     return render_template('caregiver/index.html', 
                            assigned_patients=assigned_patients,
                            view_user_id=view_user_id,
-                           observation_history=observation_history)
+                           observation_history=observation_history,
+                           notes_cursor=notes_cursor)
+
+@app.route('/visit_notes/<int:patient_id>')
+@roles_required('home_nurse', 'migrant_worker', 'caregiver')
+def visit_notes(patient_id):
+    # Next page of the dashboards' observation history, for infinite scroll
+    if not can_view_patient(session['user_id'], session.get('role'), patient_id):
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        notes, cursor = visit_notes_page(get_db(), patient_id, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = Response(render_template('partials/visit_notes.html', notes=notes))
+    if cursor:
+        response.headers['X-Next-Cursor'] = cursor
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
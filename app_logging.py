@@ -0,0 +1,119 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+# Application logging. Request threads only put records on a bounded queue; one
+# listener thread per process formats them as JSON lines and writes the file,
+# which rotates by size (or by time with HEALINK_LOG_WHEN) and keeps
+# HEALINK_LOG_BACKUPS old files. When the queue is full, records are dropped and
+# counted rather than making a request wait.
+#   HEALINK_LOG_LEVEL      DEBUG | INFO (default) | WARNING | ...; home() redirects log at DEBUG
+#   HEALINK_LOG_FILE       default logs/auth_debug.log; '-' for stderr. Rotation is per
+#                          process, so with several workers prefer '-' or one file each
+#   HEALINK_LOG_MAX_BYTES  size rotation threshold (default 10 MiB)
+#   HEALINK_LOG_WHEN       e.g. 'midnight' to rotate by time instead of size
+#   HEALINK_LOG_BACKUPS    rotated files kept (default 5)
+LOG_LEVEL = os.environ.get('HEALINK_LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.environ.get('HEALINK_LOG_FILE', os.path.join(os.path.dirname(__file__), 'logs', 'auth_debug.log'))
+LOG_MAX_BYTES = int(os.environ.get('HEALINK_LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_WHEN = os.environ.get('HEALINK_LOG_WHEN')
+LOG_BACKUPS = int(os.environ.get('HEALINK_LOG_BACKUPS', 5))
+LOG_QUEUE_SIZE = int(os.environ.get('HEALINK_LOG_QUEUE_SIZE', 10000))
+
+LOGGER_NAME = 'healink'
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed as extra={'fields': {...}} are merged in."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _file_handler(path):
+    if path == '-':
+        return logging.StreamHandler()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if LOG_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(path, when=LOG_WHEN, backupCount=LOG_BACKUPS, utc=True)
+    return logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """QueueHandler that starts its listener thread lazily in each process and
+    drops records instead of blocking when the queue is full.
+    """
+
+    def __init__(self, target, max_queue=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize=max_queue))
+        self.target = target
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Started lazily so each gunicorn worker gets its own writer after fork
+        if self._listener is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._listener is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+
+
+_handler = None
+
+
+def configure_logging():
+    """Attach the queued JSON file handler to the 'healink' logger (once per process)."""
+    global _handler
+    if _handler is not None:
+        return _handler
+    target = _file_handler(LOG_FILE)
+    target.setFormatter(JsonFormatter())
+    _handler = AsyncLogHandler(target)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(_handler)
+    logger.propagate = False
+    # Flush what is still queued on a clean shutdown
+    atexit.register(_handler.stop)
+    return _handler
+
+
+def get_logger(name):
+    return logging.getLogger(f'{LOGGER_NAME}.{name}')
+
+
+def stats():
+    if _handler is None:
+        return {}
+    return {'queued': _handler.queue.qsize(), 'dropped': _handler.dropped, 'level': LOG_LEVEL}
@@ -0,0 +1,152 @@
+import argparse
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+import db
+
+# Time-partitioned archive of health_data. Readings older than
+# ARCHIVE_AFTER_DAYS are moved into one SQLite file per month (health_YYYY_MM.db)
+# next to the live database, so data/health.db only holds recent, hot rows.
+# archive_partitions in the live database lists the months and how far each has
+# been moved; readers attach the partitions their time range needs, one at a
+# time, through reading_sources(). Run from cron:
+#
+#   python archive.py [--older-than-days 90] [--vacuum]
+
+ARCHIVE_DIR = os.environ.get('HEALINK_ARCHIVE_DIR')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('HEALINK_ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_ALIAS = 'archive'
+
+_ARCHIVE_SCHEMA = (
+    # Same columns as the live table; ids are kept so they stay unique across partitions
+    '''
+    CREATE TABLE IF NOT EXISTS {alias}.health_data (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        heart_rate INTEGER,
+        blood_pressure_sys INTEGER,
+        blood_pressure_dia INTEGER,
+        oxygen_level INTEGER,
+        temperature REAL,
+        sugar_level REAL,
+        timestamp DATETIME
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS {alias}.idx_health_data_user_time ON health_data (user_id, timestamp)",
+)
+
+
+def archive_dir():
+    return ARCHIVE_DIR or os.path.join(os.path.dirname(db.DB_PATH), 'archive')
+
+
+def _month_bounds(month):
+    start = datetime.strptime(month, '%Y-%m')
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def partitions(conn, start=None, end=None):
+    """archive_partitions rows whose month overlaps [start, end), oldest first."""
+    try:
+        rows = conn.execute("SELECT month, path, archived_through FROM archive_partitions ORDER BY month").fetchall()
+    except sqlite3.OperationalError:
+        # Database from before the archive migration
+        return []
+    selected = []
+    for row in rows:
+        month_start, month_end = _month_bounds(row['month'])
+        if (end and month_start >= end) or (start and month_end <= start):
+            continue
+        selected.append(row)
+    return selected
+
+
+def reading_sources(conn, start=None, end=None, newest_first=False):
+    """Yield (table, where, params) for every place readings in [start, end) may live.
+
+    Archive partitions are attached (as ARCHIVE_ALIAS) only while the caller is on
+    that source, and `where` limits them to rows whose move has completed. The
+    live table comes last, or first with newest_first. Exhaust every cursor on a
+    source before asking for the next one, and don't hold a write transaction
+    across archive sources: SQLite can't detach a database in either case.
+    """
+    archived = partitions(conn, start, end)
+    if newest_first:
+        yield 'main.health_data', None, []
+        archived.reverse()
+    for partition in archived:
+        path = os.path.join(archive_dir(), partition['path'])
+        if not os.path.exists(path):
+            # Never let ATTACH create an empty stand-in for a missing archive
+            raise FileNotFoundError(f"Archive partition {partition['month']} is missing: {path}")
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_ALIAS}", (path,))
+        try:
+            yield f'{ARCHIVE_ALIAS}.health_data', 'timestamp < ?', [partition['archived_through']]
+        finally:
+            conn.execute(f"DETACH DATABASE {ARCHIVE_ALIAS}")
+    if not newest_first:
+        yield 'main.health_data', None, []
+
+
+def archive_readings(older_than_days=ARCHIVE_AFTER_DAYS, vacuum=False):
+    """Move readings older than the cutoff into their monthly partitions; returns rows moved."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+    os.makedirs(archive_dir(), exist_ok=True)
+    conn = db.get_db_connection()
+    moved = 0
+    try:
+        months = [row[0] for row in conn.execute(
+            "SELECT DISTINCT substr(timestamp, 1, 7) FROM health_data WHERE timestamp < ? ORDER BY 1", (cutoff,)
+        )]
+        for month in months:
+            month_start, month_end = _month_bounds(month)
+            through = min(month_end, cutoff)
+            filename = f"health_{month.replace('-', '_')}.db"
+            conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_ALIAS}", (os.path.join(archive_dir(), filename),))
+            try:
+                for statement in _ARCHIVE_SCHEMA:
+                    conn.execute(statement.format(alias=ARCHIVE_ALIAS))
+                # Copy first; readers keep using the live rows until the watermark moves.
+                # OR IGNORE makes a rerun after a crash between the two commits harmless.
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {ARCHIVE_ALIAS}.health_data
+                    SELECT id, user_id, heart_rate, blood_pressure_sys, blood_pressure_dia,
+                           oxygen_level, temperature, sugar_level, timestamp
+                    FROM main.health_data WHERE timestamp >= ? AND timestamp < ?
+                """, (month_start, through))
+                conn.commit()
+
+                # Then delete and advance the watermark in one transaction on the live database
+                deleted = conn.execute(
+                    "DELETE FROM main.health_data WHERE timestamp >= ? AND timestamp < ?", (month_start, through)
+                ).rowcount
+                count = conn.execute(f"SELECT COUNT(*) FROM {ARCHIVE_ALIAS}.health_data").fetchone()[0]
+                conn.execute("""
+                    INSERT INTO archive_partitions (month, path, archived_through, readings) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(month) DO UPDATE SET
+                        archived_through = MAX(archived_through, excluded.archived_through),
+                        readings = excluded.readings
+                """, (month, filename, through, count))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute(f"DETACH DATABASE {ARCHIVE_ALIAS}")
+            moved += deleted
+            print(f"[*] {month}: moved {deleted} readings to {filename} ({count} archived)")
+        if vacuum and moved:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move old readings into monthly archive databases.')
+    parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--vacuum', action='store_true', help='shrink the live database file afterwards')
+    args = parser.parse_args()
+    db.init_db()
+    print(f"Archived {archive_readings(args.older_than_days, args.vacuum)} readings")
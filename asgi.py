@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from app import app as flask_app
+from routes_api import vitals_hub, can_view_patient
+from associations import association_index
+from sos import active_sos, visible_alerts
+
+# Async serving mode. Long-lived SSE streams are served natively on the event
+# loop, so an open EventSource costs a coroutine instead of a worker thread;
+# every other route still runs the unchanged Flask app on a thread pool.
+#
+#   uvicorn asgi:application --host 0.0.0.0 --port 5000
+#   gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+WSGI_THREADS = int(os.environ.get('HEALINK_ASGI_WSGI_THREADS', 16))
+KEEPALIVE = b": keepalive\n\n"
+
+wsgi_application = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+# The stream loader uses get_db(), which needs an app context off the request thread
+vitals_hub.loader_context = flask_app.app_context
+active_sos.loader_context = flask_app.app_context
+
+
+def _load_session(scope):
+    raw = b'; '.join(value for name, value in scope.get('headers', []) if name == b'cookie')
+    if not raw:
+        return {}
+    cookie = SimpleCookie()
+    try:
+        cookie.load(raw.decode('latin-1'))
+    except Exception:
+        return {}
+    morsel = cookie.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return {}
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+    try:
+        return serializer.loads(morsel.value, max_age=max_age)
+    except BadSignature:
+        return {}
+
+
+def _authorize(viewer_id, role, patient_id):
+    with flask_app.app_context():
+        return can_view_patient(viewer_id, role, patient_id)
+
+
+async def _respond(send, status):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-length', b'0')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def stream_vitals(scope, receive, send):
+    """Async equivalent of routes_api.stream_data."""
+    session = _load_session(scope)
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    user_id = (query.get('user_id') or [None])[0] or session.get('user_id')
+    if not user_id:
+        return await _respond(send, 401)
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return await _respond(send, 400)
+
+    loop = asyncio.get_running_loop()
+    allowed = await loop.run_in_executor(None, _authorize, session.get('user_id'), session.get('role'), user_id)
+    if not allowed:
+        return await _respond(send, 403)
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache')]
+    })
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        with vitals_hub.viewer(user_id) as ch:
+            last_id = 0
+            while True:
+                waiter = asyncio.ensure_future(vitals_hub.wait_async(user_id, ch, last_id))
+                await asyncio.wait({waiter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not waiter.done():
+                    waiter.cancel()
+                    return
+                latest = waiter.result()
+                if latest is None:
+                    body = KEEPALIVE
+                else:
+                    last_id, body = latest
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnected.cancel()
+
+
+def _monitored(viewer_id):
+    with flask_app.app_context():
+        return association_index.patients_of(viewer_id)
+
+
+async def stream_sos(scope, receive, send):
+    """Async equivalent of routes_api.sos_stream."""
+    session = _load_session(scope)
+    viewer_id, role = session.get('user_id'), session.get('role')
+    if not viewer_id:
+        return await _respond(send, 401)
+
+    loop = asyncio.get_running_loop()
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache')]
+    })
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        version = None
+        sent = None
+        while True:
+            waiter = asyncio.ensure_future(active_sos.wait_async(version))
+            await asyncio.wait({waiter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not waiter.done():
+                waiter.cancel()
+                return
+            latest = waiter.result()
+            if latest is None:
+                body = KEEPALIVE
+            else:
+                version, alerts = latest
+                monitored = () if role == 'admin' else await loop.run_in_executor(None, _monitored, viewer_id)
+                visible = visible_alerts(alerts, viewer_id, role, monitored)
+                if visible == sent:
+                    continue
+                sent = visible
+                body = f"data: {json.dumps({'version': version, 'active': visible})}\n\n".encode()
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnected.cancel()
+
+
+STREAM_ROUTES = {
+    '/api/stream': stream_vitals,
+    '/api/sos_stream': stream_sos,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    handler = STREAM_ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if handler is not None:
+        return await handler(scope, receive, send)
+    return await wsgi_application(scope, receive, send)
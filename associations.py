@@ -0,0 +1,69 @@
+from collections import defaultdict
+from db import bump_generation
+from reloadable import Reloadable
+import notifier
+
+# In-memory copy of user_associations, kept in both directions (monitor ->
+# patients and patient -> monitors), so authorization checks and dashboard
+# patient lists are set lookups instead of queries. Admin edits bump the
+# 'user_associations' generation and publish on the 'associations' channel
+# (see reloadable.py).
+
+ASSOCIATIONS_RELOAD_INTERVAL = 5
+ASSOCIATIONS_GENERATION = 'user_associations'
+
+_EMPTY = frozenset()
+
+
+class AssociationIndex(Reloadable):
+    GENERATION = ASSOCIATIONS_GENERATION
+    RELOAD_INTERVAL = ASSOCIATIONS_RELOAD_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self._patients = {}
+        self._monitors = {}
+        self.reloads = 0
+
+    def _load(self, conn, generation):
+        patients = defaultdict(set)
+        monitors = defaultdict(set)
+        for monitor_id, patient_id in conn.execute("SELECT monitor_id, patient_id FROM user_associations"):
+            patients[monitor_id].add(patient_id)
+            monitors[patient_id].add(monitor_id)
+        self._patients = {k: frozenset(v) for k, v in patients.items()}
+        self._monitors = {k: frozenset(v) for k, v in monitors.items()}
+        self._version = generation
+        self.reloads += 1
+
+    def patients_of(self, monitor_id):
+        self._ensure_fresh()
+        return self._patients.get(monitor_id, _EMPTY)
+
+    def monitors_of(self, patient_id):
+        self._ensure_fresh()
+        return self._monitors.get(patient_id, _EMPTY)
+
+    def is_monitor(self, monitor_id, patient_id):
+        return patient_id in self.patients_of(monitor_id)
+
+    def stats(self):
+        return {
+            'monitors': len(self._patients),
+            'patients': len(self._monitors),
+            'associations': sum(len(v) for v in self._patients.values()),
+            'reloads': self.reloads
+        }
+
+
+association_index = AssociationIndex()
+notifier.subscribe('associations', association_index.mark_stale)
+
+
+def associations_changed(conn):
+    """Record a user_associations change; call publish_associations_changed() after committing."""
+    bump_generation(conn, ASSOCIATIONS_GENERATION)
+
+
+def publish_associations_changed():
+    notifier.publish('associations', '*')
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+# Concurrent /api/stream capacity benchmark.
+#
+# Opens N EventSource-style connections against a running server, then posts one
+# reading and measures how long it takes to reach every connected viewer.
+#
+#   python bench_streams.py --url http://127.0.0.1:5000 --clients 2000 --user-id 2
+
+
+def login(base_url, username, password):
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+    opener.open(f'{base_url}/login', data=data, timeout=30)
+    return '; '.join(f'{c.name}={c.value}' for c in jar)
+
+
+def post_reading(base_url, api_key, user_id, heart_rate):
+    body = json.dumps({'api_key': api_key, 'user_id': user_id, 'heart_rate': heart_rate}).encode()
+    req = urllib.request.Request(f'{base_url}/api/update', data=body, headers={'Content-Type': 'application/json'})
+    urllib.request.urlopen(req, timeout=10).read()
+
+
+class Viewer:
+    def __init__(self):
+        self.connected = False
+        self.status = None
+        self.buffer = b''
+        self.seen_at = None
+
+
+async def run_viewer(viewer, host, port, path, cookie, marker, connect_timeout):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), connect_timeout)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\nAccept: text/event-stream\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), connect_timeout)
+        viewer.status = int(status_line.split()[1]) if status_line else None
+        viewer.connected = viewer.status == 200
+        if not viewer.connected:
+            writer.close()
+            return
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                return
+            viewer.buffer = (viewer.buffer + chunk)[-4096:]
+            if viewer.seen_at is None and marker['value'] and marker['value'] in viewer.buffer:
+                viewer.seen_at = time.perf_counter()
+    except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+        viewer.connected = False
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def measure(args):
+    """Run one stream benchmark against args.url and return the result dict."""
+    parsed = urllib.parse.urlparse(args.url)
+    host, port = parsed.hostname, parsed.port or 80
+    cookie = await asyncio.to_thread(login, args.url, args.username, args.password)
+    path = f'/api/stream?user_id={args.user_id}'
+    marker = {'value': None}
+
+    viewers = [Viewer() for _ in range(args.clients)]
+    tasks = []
+    for viewer in viewers:
+        tasks.append(asyncio.ensure_future(run_viewer(viewer, host, port, path, cookie, marker, args.connect_timeout)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp)
+    await asyncio.sleep(args.settle)
+
+    connected = [v for v in viewers if v.connected]
+    heart_rate = random.randint(10000, 99999)
+    marker['value'] = f'"heart_rate": {heart_rate}'.encode()
+    sent_at = time.perf_counter()
+    post_error = None
+    try:
+        await asyncio.to_thread(post_reading, args.url, args.api_key, args.user_id, heart_rate)
+    except OSError as e:
+        # A server whose workers are all pinned by streams cannot even accept the reading
+        post_error = str(e)
+        connected = []
+    deadline = sent_at + args.deliver_timeout
+    while time.perf_counter() < deadline and any(v.seen_at is None for v in connected):
+        await asyncio.sleep(0.01)
+
+    latencies = [(v.seen_at - sent_at) * 1000 for v in connected if v.seen_at is not None]
+    result = {
+        'url': args.url,
+        'clients': args.clients,
+        'connected': len(connected),
+        'delivered': len(latencies),
+        'delivery_ms_p50': percentile(latencies, 50),
+        'delivery_ms_p95': percentile(latencies, 95),
+        'delivery_ms_max': max(latencies) if latencies else None,
+        'post_error': post_error,
+    }
+    for task in tasks:
+        task.cancel()
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Measure concurrent /api/stream capacity and delivery latency.')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--user-id', type=int, default=2)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--api-key', default='HEALINK_v1_KEY')
+    parser.add_argument('--ramp', type=float, default=0.0, help='seconds between opening connections')
+    parser.add_argument('--settle', type=float, default=3.0, help='seconds to wait after opening connections')
+    parser.add_argument('--connect-timeout', type=float, default=10.0)
+    parser.add_argument('--deliver-timeout', type=float, default=20.0)
+    return parser
+
+
+if __name__ == '__main__':
+    print(json.dumps(asyncio.run(measure(build_parser().parse_args())), indent=2))
@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+# Reproducible benchmark suite. Seeds a synthetic database in a temporary
+# directory, then drives the app both through Flask's test client (handler cost
+# without network) and through a locally started threaded server (concurrency,
+# SSE). Every run writes one JSON document, so results can be diffed between commits:
+#
+#   python benchmark.py -o bench_results.json              # full run
+#   python benchmark.py --quick -o /tmp/quick.json         # smoke-sized run
+#
+# The seed is fixed, so two runs on the same commit load the same data.
+
+API_KEY = 'HEALINK_v1_KEY'
+BENCH_PASSWORD = 'bench123'
+
+SIZES = {
+    'full': {'patients': 500, 'readings': 1_000_000, 'requests': 2000, 'logins': 200, 'viewers': 200},
+    'quick': {'patients': 50, 'readings': 50_000, 'requests': 200, 'logins': 20, 'viewers': 20},
+}
+
+
+def percentiles(samples_ms):
+    if not samples_ms:
+        return {'count': 0}
+    values = sorted(samples_ms)
+
+    def pick(pct):
+        return round(values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))], 3)
+
+    return {'count': len(values), 'p50_ms': pick(50), 'p95_ms': pick(95), 'p99_ms': pick(99), 'max_ms': round(values[-1], 3)}
+
+
+def timed(func, count):
+    """Time func(i) for each i; func returns a test client response, counted as an error unless 2xx/3xx."""
+    samples = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        response = func(i)
+        samples.append((time.perf_counter() - t) * 1000)
+        if not 200 <= response.status_code < 400:
+            errors += 1
+    result = percentiles(samples)
+    result['per_second'] = round(count / (time.perf_counter() - started), 1)
+    result['errors'] = errors
+    return result
+
+
+def timed_concurrent(func, count, concurrency):
+    def one(i):
+        t = time.perf_counter()
+        ok = func(i)
+        return (time.perf_counter() - t) * 1000, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(one, range(count)))
+    result = percentiles([ms for ms, _ in outcomes])
+    result['per_second'] = round(count / (time.perf_counter() - started), 1)
+    result['concurrency'] = concurrency
+    result['errors'] = sum(1 for _, ok in outcomes if not ok)
+    return result
+
+
+def seed(conn, size, rng):
+    """Patients, one nurse monitoring the first 20 of them, and readings over 30 days."""
+    from passwords import hash_password
+    from rollups import rebuild_rollups
+    from vitals import rebuild_patient_latest
+
+    password = hash_password(BENCH_PASSWORD)
+    conn.executemany(
+        "INSERT INTO users (username, username_key, password, role, full_name) VALUES (?, ?, ?, ?, ?)",
+        [(f'bench_patient{i}', f'bench_patient{i}', password, 'patient', f'Bench Patient {i}') for i in range(size['patients'])]
+        + [('bench_nurse', 'bench_nurse', password, 'home_nurse', 'Bench Nurse')]
+    )
+    patient_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'patient' ORDER BY id")]
+    nurse_id = conn.execute("SELECT id FROM users WHERE username_key = 'bench_nurse'").fetchone()[0]
+    conn.executemany("INSERT INTO user_associations (monitor_id, patient_id) VALUES (?, ?)",
+                     [(nurse_id, pid) for pid in patient_ids[:20]])
+    conn.executemany(
+        "INSERT INTO health_data (user_id, heart_rate, blood_pressure_sys, blood_pressure_dia, oxygen_level, temperature, sugar_level, timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now', ?))",
+        ((rng.choice(patient_ids), rng.randint(55, 110), rng.randint(105, 150), rng.randint(65, 95),
+          rng.randint(92, 100), round(rng.uniform(36.0, 38.0), 1), round(rng.uniform(70, 160), 1),
+          f'-{rng.randint(0, 30 * 86400)} seconds') for _ in range(size['readings']))
+    )
+    rebuild_patient_latest(conn)
+    rebuild_rollups(conn)
+    conn.commit()
+    return patient_ids, nurse_id
+
+
+def bench_test_client(app, patient_ids, size, rng):
+    results = {}
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+
+    def history(i):
+        return client.get(f'/api/history?user_id={rng.choice(patient_ids)}')
+    results['history_latest'] = timed(history, size['requests'])
+
+    def history_auto(i):
+        return client.get(f'/api/history?user_id={rng.choice(patient_ids)}&resolution=auto&from={_days_ago(30)}')
+    results['history_30d_auto'] = timed(history_auto, size['requests'])
+
+    nurse = app.test_client()
+    nurse.post('/login', data={'username': 'bench_nurse', 'password': BENCH_PASSWORD})
+    results['dashboard_nurse'] = timed(lambda i: nurse.get(f'/nurse?user_id={patient_ids[i % 20]}'), size['requests'] // 4)
+    results['dashboard_admin'] = timed(lambda i: client.get('/admin/'), size['requests'] // 4)
+    patient = app.test_client()
+    patient.post('/login', data={'username': 'bench_patient0', 'password': BENCH_PASSWORD})
+    results['dashboard_patient'] = timed(lambda i: patient.get('/patient'), size['requests'] // 4)
+
+    def ingest(i):
+        return client.post('/api/update', json={'user_id': rng.choice(patient_ids), 'heart_rate': rng.randint(55, 110)},
+                    headers={'X-API-Key': API_KEY})
+    results['ingest_test_client'] = timed(ingest, size['requests'])
+    return results
+
+
+def _days_ago(days):
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(time.time() - days * 86400))
+
+
+def _post(url, data=None, json_body=None, headers=None):
+    if json_body is not None:
+        data = json.dumps(json_body).encode()
+        headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+    elif data is not None:
+        data = urllib.parse.urlencode(data).encode()
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    try:
+        with opener.open(request, timeout=30) as response:
+            response.read()
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def bench_server(base_url, patient_ids, size, concurrency):
+    import bench_streams
+    results = {}
+
+    def ingest(i):
+        return _post(f'{base_url}/api/update', json_body={'user_id': patient_ids[i % len(patient_ids)], 'heart_rate': 60 + i % 50},
+                     headers={'X-API-Key': API_KEY})
+    results['ingest_http'] = timed_concurrent(ingest, size['requests'], concurrency)
+
+    def login(i):
+        # A successful login ends in a redirect to the dashboard, which urllib follows
+        return _post(f'{base_url}/login', data={'username': f'bench_patient{i % len(patient_ids)}', 'password': BENCH_PASSWORD})
+    results['login_http'] = timed_concurrent(login, size['logins'], concurrency)
+
+    args = bench_streams.build_parser().parse_args([
+        '--url', base_url, '--clients', str(size['viewers']), '--user-id', str(patient_ids[0]),
+        '--settle', '2', '--deliver-timeout', '10',
+    ])
+    results['stream_delivery'] = asyncio.run(bench_streams.measure(args))
+    # The port is random per run; keep the report diffable
+    results['stream_delivery'].pop('url', None)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ingest, history, streams, login and dashboards.')
+    parser.add_argument('--quick', action='store_true', help='small dataset and request counts')
+    parser.add_argument('--readings', type=int, help='override the number of seeded readings')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads for the HTTP benchmarks')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+
+    size = dict(SIZES['quick' if args.quick else 'full'])
+    if args.readings is not None:
+        size['readings'] = args.readings
+    rng = random.Random(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix='healink-bench-')
+    # Both must be set before the app (and its logging) is imported
+    os.environ.setdefault('HEALINK_LOG_FILE', os.path.join(workdir, 'app.log'))
+    import db
+    db.DB_PATH = os.path.join(workdir, 'health.db')
+    from app import app
+
+    started = time.perf_counter()
+    conn = db.get_db_connection()
+    patient_ids, _ = seed(conn, size, rng)
+    conn.close()
+    seed_seconds = time.perf_counter() - started
+    print(f"[*] Seeded {size['readings']} readings for {len(patient_ids)} patients in {seed_seconds:.1f}s")
+
+    with app.app_context():
+        results = bench_test_client(app, patient_ids, size, rng)
+    print('[*] Test client benchmarks done')
+
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        results.update(bench_server(f'http://127.0.0.1:{server.server_port}', patient_ids, size, args.concurrency))
+    finally:
+        server.shutdown()
+    print('[*] Server benchmarks done')
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'size': size,
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+            'seed_seconds': round(seed_seconds, 2),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
+    # The SSE handler threads of the local server never finish on their own, and
+    # os._exit skips atexit, so stop the password workers first
+    from passwords import password_pool
+    password_pool.shutdown()
+    sys.stdout.flush()
+    os._exit(0)
@@ -0,0 +1,203 @@
+import ast
+import importlib
+import os
+import random
+import sys
+import tempfile
+import db
+
+# Runs EXPLAIN QUERY PLAN over every SQL statement passed to execute()/executemany()
+# in the modules the app runs, against a freshly initialised database seeded with a
+# large synthetic dataset, and exits non-zero if any statement falls back to a
+# full table scan. Run it after changing a query or the indexes in migrations.py:
+#
+#   python check_query_plans.py [--verbose]
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCES = ('app.py', 'routes_api.py', 'routes_admin.py', 'sos.py', 'rollups.py', 'vitals.py', 'user_directory.py',
+           'associations.py', 'clinical.py', 'rules.py', 'export.py', 'alert_scan.py')
+
+SEED_USERS = 20000
+SEED_READINGS = 500000
+SEED_ROWS = 50000
+
+# Statements that read a whole table by design (admin listings, in-memory
+# indexes loaded once per change); the table a scan is accepted on is named
+# explicitly so any other scan still fails.
+ALLOWED_SCANS = {
+    'SELECT COUNT(*) FROM users': 'users',
+    'SELECT ua.id, m.full_name as monitor_name': 'ua',
+    'SELECT monitor_id, patient_id FROM user_associations': 'user_associations',
+    'SELECT patient_id, rule_id, enabled, params FROM clinical_rule_overrides': 'clinical_rule_overrides',
+    "SELECT 1 FROM sqlite_master WHERE type = 'table'": 'sqlite_master',
+}
+
+# SQL that is assembled at run time is rebuilt by evaluating the expression in its
+# module, with these stand-ins (Python source) for the function's local variables:
+# a typical table, tier and set of filters. Statements in other functions that
+# need locals (the maintenance rebuilds) are reported as skipped.
+SAMPLE_LOCALS = {
+    'rollups.choose_resolution': {'tier': "'minute'"},
+    'rollups.update_rollups': {'sql': "_UPSERT_SQL['minute']"},
+    'rollups.read_history': {'table': "'health_data'", 'where': "['user_id = ?']", 'source_where': 'None',
+                             'resolution': "'hour'"},
+    'user_directory.search_users': {
+        'sql': "'SELECT u.id, u.username, u.full_name, u.role FROM users u "
+               "WHERE u.id IN (SELECT rowid FROM users_search WHERE users_search MATCH ?)'"},
+    'export.iter_readings': {'table': "'health_data'", 'conditions': "['user_id IN (?)', 'timestamp >= ?']"},
+    'alert_scan.fetch_columns': {'table': "'health_data'", 'conditions': "['user_id IN (?)', 'timestamp >= ?']"},
+}
+
+
+class _Placeholders(ast.NodeTransformer):
+    # f-strings interpolate placeholder lists (','.join('?' * len(ids))); one placeholder stands in
+    def visit_FormattedValue(self, node):
+        if "'?'" in ast.unparse(node.value):
+            return ast.Constant('?')
+        return node
+
+
+def _calls(tree):
+    """Yield (function name, execute()/executemany() call) for every call in a function."""
+    for func in ast.walk(tree):
+        if isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for node in ast.walk(func):
+                if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                        and node.func.attr in ('execute', 'executemany') and node.args):
+                    yield func.name, node
+
+
+def extract_statements(path):
+    """Yield (line, sql) for every SQL statement handed to execute()/executemany();
+    sql is None when it can't be rebuilt without a run.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    module = None
+    seen = set()
+    for func, node in _calls(tree):
+        # Nested functions are walked twice
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        arg = node.args[0]
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            yield node.lineno, arg.value
+            continue
+        if module is None:
+            module = importlib.import_module(name)
+        namespace = dict(vars(module))
+        for local, expression in SAMPLE_LOCALS.get(f'{name}.{func}', {}).items():
+            namespace[local] = eval(expression, namespace)
+        try:
+            sql = eval(ast.unparse(_Placeholders().visit(arg)), namespace)
+        except Exception:
+            sql = None
+        yield node.lineno, sql if isinstance(sql, str) else None
+
+
+def seed(conn):
+    rng = random.Random(42)
+    roles = ['patient'] * 6 + ['home_nurse', 'caregiver', 'migrant_worker', 'admin']
+    conn.executemany(
+        "INSERT INTO users (username, username_key, password, role, full_name) VALUES (?, ?, ?, ?, ?)",
+        ((f"User{i}", f"user{i}", 'x', rng.choice(roles), f"User {i}") for i in range(SEED_USERS))
+    )
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+    conn.executemany(
+        "INSERT INTO user_associations (monitor_id, patient_id) VALUES (?, ?)",
+        ((rng.choice(user_ids), rng.choice(user_ids)) for _ in range(SEED_ROWS))
+    )
+    conn.executemany(
+        "INSERT INTO health_data (user_id, heart_rate, blood_pressure_sys, blood_pressure_dia, oxygen_level, temperature, sugar_level, timestamp) "
+        "VALUES (?, ?, 120, 80, 97, 36.6, 110, datetime('now', ?))",
+        ((rng.choice(user_ids), rng.randint(50, 120), f"-{rng.randint(0, 8640000)} seconds") for _ in range(SEED_READINGS))
+    )
+    conn.executemany(
+        "INSERT INTO visit_notes (patient_id, worker_id, note) VALUES (?, ?, 'note')",
+        ((rng.choice(user_ids), rng.choice(user_ids)) for _ in range(SEED_ROWS))
+    )
+    conn.executemany(
+        "INSERT INTO sos_alerts (patient_id, status) VALUES (?, ?)",
+        ((rng.choice(user_ids), rng.choice(['active'] + ['dismissed'] * 19)) for _ in range(SEED_ROWS))
+    )
+    conn.executemany(
+        "INSERT INTO medication_alerts (user_id, med_name, dosage, time, taken) VALUES (?, 'med', '1', '08:00', ?)",
+        ((rng.choice(user_ids), rng.randint(0, 1)) for _ in range(SEED_ROWS))
+    )
+    conn.executemany(
+        "INSERT INTO doctor_reminders (user_id, doctor_name, consultation_type, date, time) VALUES (?, 'Dr', 'visit', '2024-01-01', '09:00')",
+        ((rng.choice(user_ids),) for _ in range(SEED_ROWS))
+    )
+    conn.executemany(
+        "INSERT INTO hospitals (name, address, contact_person, email) VALUES (?, '', '', '')",
+        ((f"Hospital {i}",) for i in range(1000))
+    )
+    conn.commit()
+
+
+def scanned_tables(conn, sql, partial_indexes):
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count('?')).fetchall()
+    details = [row[3] for row in plan]
+    scans = []
+    for detail in details:
+        words = detail.split()
+        if words[:1] != ['SCAN'] or len(words) < 2 or words[1] in ('CONSTANT', 'SUBQUERY'):
+            continue
+        # "SCAN t USING [COVERING] INDEX i" still visits every row, unless i is a
+        # partial index that only holds the rows the query asks for
+        if words[-2:-1] == ['INDEX'] and words[-1] in partial_indexes:
+            continue
+        # FTS5 answers MATCH from its own index ("VIRTUAL TABLE INDEX 0:M2"); a bare "0:" reads it all
+        if words[2:5] == ['VIRTUAL', 'TABLE', 'INDEX'] and words[-1].partition(':')[2]:
+            continue
+        scans.append(words[1])
+    return scans, details
+
+
+def allowed_scan(sql):
+    normalized = ' '.join(sql.split())
+    for prefix, table in ALLOWED_SCANS.items():
+        if normalized.startswith(prefix):
+            return table
+    return None
+
+
+def check_query_plans(verbose=False):
+    tmpdir = tempfile.TemporaryDirectory()
+    db.DB_PATH = os.path.join(tmpdir.name, 'health.db')
+    db.init_db()
+    conn = db.get_db_connection()
+    seed(conn)
+    partial_indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")}
+
+    failures = 0
+    checked = 0
+    skipped = 0
+    for source in SOURCES:
+        for line, sql in extract_statements(os.path.join(BASE_DIR, source)):
+            if sql is None:
+                skipped += 1
+                if verbose:
+                    print(f"skip {source}:{line}  (built at run time)")
+                continue
+            scans, details = scanned_tables(conn, sql, partial_indexes)
+            allowed = allowed_scan(sql)
+            bad = [table for table in scans if table != allowed]
+            checked += 1
+            if bad:
+                failures += 1
+            if bad or verbose:
+                print(f"{'FAIL' if bad else 'ok'}   {source}:{line}  {' '.join(sql.split())[:100]}")
+                for detail in details:
+                    print(f"         {detail}")
+
+    conn.close()
+    tmpdir.cleanup()
+    print(f"{checked} statements checked, {failures} full table scans, {skipped} skipped")
+    return failures == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_query_plans('--verbose' in sys.argv) else 1)
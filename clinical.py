@@ -0,0 +1,63 @@
+from db import get_db
+from ttl_cache import TTLCache
+import notifier
+
+CLINICAL_CACHE_TTL = 300
+CLINICAL_CACHE_MAX_ENTRIES = 10000
+CLINICAL_LOAD_CHUNK = 500
+
+# Context flag -> medication keywords that set it. Replaced by the "contexts"
+# section of clinical_rules.json when the rule engine loads.
+CONTEXT_MEDICATIONS = {
+    'diabetic': ('insulin', 'metformin', 'glyburide'),
+    'antihypertensive': ('amlodipine', 'lisinopril', 'losartan'),
+}
+
+NO_CONTEXT = frozenset()
+
+
+def parse_clinical_context(medications):
+    """Return the frozenset of context flags implied by a medications text."""
+    if not medications:
+        return NO_CONTEXT
+    meds = medications.lower()
+    return frozenset(flag for flag, keywords in CONTEXT_MEDICATIONS.items() if any(x in meds for x in keywords))
+
+
+class ClinicalContextCache(TTLCache):
+    """Parsed patient_clinical_info per patient, dropped when the row is written
+    ('clinical' notifier channel).
+    """
+
+    def __init__(self, ttl=CLINICAL_CACHE_TTL, max_entries=CLINICAL_CACHE_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+
+    def _load(self, patient_id):
+        row = get_db().execute("SELECT medications FROM patient_clinical_info WHERE patient_id = ?", (patient_id,)).fetchone()
+        return parse_clinical_context(row['medications'] if row else None)
+
+
+clinical_cache = ClinicalContextCache()
+notifier.subscribe('clinical', clinical_cache.invalidate)
+
+
+def get_clinical_context(patient_id):
+    return clinical_cache.get(patient_id)
+
+
+def load_clinical_contexts(conn, patient_ids):
+    """{patient_id: context} for many patients at once, read directly rather than through the cache."""
+    contexts = dict.fromkeys(patient_ids, NO_CONTEXT)
+    for i in range(0, len(patient_ids), CLINICAL_LOAD_CHUNK):
+        chunk = patient_ids[i:i + CLINICAL_LOAD_CHUNK]
+        for row in conn.execute(f"""
+            SELECT patient_id, medications FROM patient_clinical_info
+            WHERE patient_id IN ({','.join('?' * len(chunk))})
+        """, chunk):
+            contexts[row['patient_id']] = parse_clinical_context(row['medications'])
+    return contexts
+
+
+def invalidate_clinical_context(patient_id):
+    """Call after committing a change to the patient's patient_clinical_info row."""
+    notifier.publish('clinical', patient_id)
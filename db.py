@@ -1,167 +1,82 @@
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash
+import threading
+from flask import g
+import metrics
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'health.db')
 API_KEY = "HEALINK_v1_KEY"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    if not os.path.exists(os.path.dirname(DB_PATH)):
-        os.makedirs(os.path.dirname(DB_PATH))
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Initial schema setup
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS health_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            heart_rate INTEGER,
-            blood_pressure_sys INTEGER,
-            blood_pressure_dia INTEGER,
-            oxygen_level INTEGER,
-            temperature REAL,
-            sugar_level REAL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS medication_alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            med_name TEXT,
-            dosage TEXT,
-            time TEXT,
-            taken INTEGER DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
+# Vital columns of health_data, in the order every writer and aggregate uses them
+READING_FIELDS = (
+    'heart_rate',
+    'blood_pressure_sys',
+    'blood_pressure_dia',
+    'oxygen_level',
+    'temperature',
+    'sugar_level',
+)
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS visit_notes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id INTEGER,
-            worker_id INTEGER,
-            note TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (worker_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
+# Connection tuning (applied to every connection we open)
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHE_SIZE_KB = 16384
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_STATEMENT_CACHE = 256
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS hospitals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            address TEXT,
-            contact_person TEXT,
-            email TEXT
-        )
-    ''')
+_local = threading.local()
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sos_alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id INTEGER,
-            status TEXT DEFAULT 'active',
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            password TEXT,
-            role TEXT,
-            full_name TEXT
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_associations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            monitor_id INTEGER,
-            patient_id INTEGER,
-            FOREIGN KEY (monitor_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
+def get_db_connection():
+    """Open a new tuned connection. Request handlers should use get_db() instead."""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000, cached_statements=DB_STATEMENT_CACHE,
+                           factory=metrics.connection_factory())
+    conn.row_factory = sqlite3.Row
+    metrics.instrument(conn)
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS patient_clinical_info (
-            patient_id INTEGER PRIMARY KEY,
-            diseases TEXT,
-            doctors TEXT,
-            medications TEXT,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
+def _thread_connection():
+    # One connection per thread, reopened after a gunicorn fork or a DB_PATH change
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.key != (os.getpid(), DB_PATH):
+        conn = get_db_connection()
+        _local.conn = conn
+        _local.key = (os.getpid(), DB_PATH)
+    return conn
 
-    # Seed default users
-    default_users = [
-        ('admin', 'admin123', 'admin', 'System Administrator'),
-        ('patient', 'patient123', 'patient', 'Robert Johnson'),
-        ('worker', 'worker123', 'migrant_worker', 'Juan Garcia'),
-        ('nurse', 'nurse123', 'home_nurse', 'Sarah Smith'),
-        ('caregiver', 'caregiver123', 'caregiver', 'Emily Johnson')
-    ]
+def get_db():
+    """Connection for the current request, reused across requests on the same thread."""
+    if 'db' not in g:
+        g.db = _thread_connection()
+    return g.db
 
-    for username, password, role, full_name in default_users:
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-        if not cursor.fetchone():
-            pwd_hash = generate_password_hash(password)
-            cursor.execute("INSERT INTO users (username, password, role, full_name) VALUES (?, ?, ?, ?)", 
-                         (username, pwd_hash, role, full_name))
+def close_db(exc=None):
+    conn = g.pop('db', None)
+    # The connection stays open for the next request; just never leak a transaction into it
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS doctor_reminders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            doctor_name TEXT,
-            consultation_type TEXT,
-            date TEXT,
-            time TEXT,
-            status TEXT DEFAULT 'pending',
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
+def init_app(app):
+    app.teardown_appcontext(close_db)
 
-    # Universal Migration: Fix legacy hashes for users added via older systems (e.g. PHP)
-    all_users = cursor.execute("SELECT id, username, password, role FROM users").fetchall()
-    
-    # Map roles to default fallback passwords ONLY if we must reset them
-    role_password_map = {
-        'admin': 'admin123',
-        'patient': 'patient123',
-        'migrant_worker': 'worker123',
-        'home_nurse': 'nurse123',
-        'caregiver': 'caregiver123'
-    }
+def get_generation(conn, name):
+    row = conn.execute("SELECT generation FROM cache_generations WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
 
-    for user in all_users:
-        # Check for PHP/BCrypt legacy hashes
-        if user['password'] and user['password'].startswith('$2y$'):
-            # Only reset if it's strictly necessary. 
-            # If the user is a known default account, we definitely reset it.
-            # If it's a new account, we use the role default but log a warning.
-            new_password = role_password_map.get(user['role'], 'healink123')
-            new_hash = generate_password_hash(new_password)
-            cursor.execute("UPDATE users SET password = ? WHERE id = ?", (new_hash, user['id']))
-            print(f"[*] Migrated legacy PHP hash for user: {user['username']} -> Reset to default {user['role']} password.")
+def bump_generation(conn, name):
+    """Invalidate every worker's cache of `name`; part of the caller's transaction."""
+    conn.execute("""
+        INSERT INTO cache_generations (name, generation) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET generation = generation + 1
+    """, (name,))
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """Bring the schema up to date; cheap when it already is (see migrations.py)."""
+    from migrations import migrate
+    migrate()
 
 if __name__ == '__main__':
     init_db()
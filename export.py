@@ -0,0 +1,142 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from archive import reading_sources
+from db import READING_FIELDS, get_db_connection
+from rollups import parse_time
+
+# Streaming export of health_data. Rows are stepped straight off a SQLite cursor
+# in fetchmany() batches and encoded into ~64 KiB chunks, so memory stays flat
+# whatever the size of the export. Used by /api/export and as a CLI:
+#
+#   python export.py --patient 2 --from 2024-01-01 --to 2024-04-01 --format csv --gzip -o out.csv.gz
+
+EXPORT_COLUMNS = ('id', 'user_id', 'timestamp') + READING_FIELDS
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_FETCH_SIZE = 5000
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_CACHE_SIZE_KB = 2048
+
+
+def iter_readings(conn, patient_ids=None, start=None, end=None):
+    """Yield health_data rows as tuples in EXPORT_COLUMNS order.
+
+    Rows come partition by partition (archived months oldest first, then the live
+    table), and by patient and time within each. That order matches
+    idx_health_data_user_time, so SQLite walks the index instead of sorting (and
+    buffering) the result set.
+    """
+    where = []
+    params = []
+    if patient_ids:
+        where.append(f"user_id IN ({','.join('?' * len(patient_ids))})")
+        params.extend(patient_ids)
+    if start:
+        where.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        where.append("timestamp < ?")
+        params.append(end)
+    for table, source_where, source_params in reading_sources(conn, start, end):
+        conditions = where + ([source_where] if source_where else [])
+        cursor = conn.execute(f"""
+            SELECT {', '.join(EXPORT_COLUMNS)} FROM {table}
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY user_id, timestamp, id
+        """, params + source_params)
+        # A plain sqlite3.Row factory would be wasted on rows we only serialize
+        cursor.row_factory = None
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+        cursor.close()
+
+
+def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(rows):
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':'))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+            size = 0
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(patient_ids=None, start=None, end=None, fmt='csv', compress=False):
+    """Encoded export as a generator of bytes. Opens (and closes) its own connection,
+    so a long download doesn't hold the request thread's shared one.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    conn = get_db_connection()
+    # A one-pass scan gains nothing from the page cache or mmap; keep both out of RSS
+    conn.execute(f"PRAGMA cache_size = -{EXPORT_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA mmap_size = 0")
+    try:
+        rows = iter_readings(conn, patient_ids, start, end)
+        chunks = csv_chunks(rows) if fmt == 'csv' else ndjson_chunks(rows)
+        if compress:
+            chunks = gzip_chunks(chunks)
+        yield from chunks
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export health_data readings.')
+    parser.add_argument('--patient', type=int, action='append', help='patient id (repeatable; default all)')
+    parser.add_argument('--from', dest='start', help='start time, inclusive (ISO date/time, UTC)')
+    parser.add_argument('--to', dest='end', help='end time, exclusive')
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('-o', '--output', help='output file (default stdout)')
+    args = parser.parse_args(argv)
+
+    start = parse_time(args.start) if args.start else None
+    end = parse_time(args.end) if args.end else None
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(args.patient, start, end, args.format, args.gzip):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,15 @@
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash
+from db import init_db
+from passwords import hash_password
+from user_directory import username_key
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'data', 'health.db')
 
 def fix_hashes():
     print(f"Fixing database at: {DB_PATH}")
+    init_db()
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
@@ -21,9 +24,9 @@ def fix_hashes():
     try:
         total_updated = 0
         for username, password in passwords.items():
-            new_hash = generate_password_hash(password)
-            # Use LOWER() to match case-insensitively
-            cursor.execute("UPDATE users SET password = ? WHERE LOWER(username) = LOWER(?)", (new_hash, username))
+            new_hash = hash_password(password)
+            # username_key is the case-insensitive, indexed form of the name
+            cursor.execute("UPDATE users SET password = ? WHERE username_key = ?", (new_hash, username_key(username)))
             total_updated += cursor.rowcount
             print(f"Updated {username} ({cursor.rowcount} records)")
         
@@ -0,0 +1,213 @@
+import argparse
+import os
+import time
+import numpy as np
+import db
+
+# Writes a synthetic dataset straight into a SQLite file, for load tests and
+# query-plan checks at realistic sizes: patients with their monitors and
+# associations, readings every --interval seconds over --days, and the visit
+# notes, medication alerts and SOS alerts that go with them. Random values are
+# drawn with NumPy a day at a time and inserted with executemany, one
+# transaction per day, so millions of rows take minutes rather than the days
+# the HTTP simulator would need. The summaries (patient_latest, rollups) are
+# rebuilt at the end.
+#
+#   python generate_dataset.py --db /tmp/load.db --patients 2000 --days 90 --interval 300
+#
+# Every generated account has the password given by --password.
+
+MONITOR_ROLES = ('home_nurse', 'caregiver', 'migrant_worker')
+PATIENTS_PER_MONITOR = 25
+MEDICATIONS = (('Metformin', '500mg'), ('Lisinopril', '10mg'), ('Atorvastatin', '20mg'), ('Amlodipine', '5mg'),
+               ('Levothyroxine', '50mcg'), ('Aspirin', '75mg'), ('Omeprazole', '20mg'), ('Insulin glargine', '10 units'))
+NOTES = ('Routine visit, patient stable.', 'Checked vitals and medication adherence.', 'Patient reports mild fatigue.',
+         'Blood pressure elevated, advised rest and follow-up.', 'Reviewed diet plan with family.',
+         'Wound dressing changed.', 'Patient sleeping poorly, discussed routine.', 'No complaints today.')
+DISEASES = ('Hypertension', 'Type 2 diabetes', 'COPD', 'Heart failure', 'Asthma', 'Chronic kidney disease')
+
+
+def insert_users(conn, rng, args, password):
+    patients = [(f'gen_patient{i}', f'gen_patient{i}', password, 'patient', f'Patient {i}') for i in range(args.patients)]
+    monitor_count = max(len(MONITOR_ROLES), args.patients // PATIENTS_PER_MONITOR)
+    monitors = [(f'gen_{role}{i}', f'gen_{role}{i}', password, role, f'{role.replace("_", " ").title()} {i}')
+                for i, role in enumerate(rng.choice(MONITOR_ROLES, monitor_count))]
+    conn.executemany("INSERT INTO users (username, username_key, password, role, full_name) VALUES (?, ?, ?, ?, ?)",
+                     patients + monitors)
+    patient_ids = np.array([row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE role = 'patient' AND username LIKE 'gen\\_%' ESCAPE '\\' ORDER BY id")])
+    monitor_ids = np.array([row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE role != 'patient' AND username LIKE 'gen\\_%' ESCAPE '\\' ORDER BY id")])
+
+    # Every patient has one to three distinct monitors
+    pairs = set()
+    for patient_id, count in zip(patient_ids.tolist(), rng.integers(1, 4, len(patient_ids)).tolist()):
+        for monitor_id in rng.choice(monitor_ids, min(count, len(monitor_ids)), replace=False).tolist():
+            pairs.add((monitor_id, patient_id))
+    conn.executemany("INSERT INTO user_associations (monitor_id, patient_id) VALUES (?, ?)", sorted(pairs))
+    return patient_ids, sorted(pairs)
+
+
+def patient_profiles(rng, n):
+    """Per-patient baselines, so each patient's series looks like one person's."""
+    diabetic = rng.random(n) < 0.15
+    hypertensive = rng.random(n) < 0.25
+    return {
+        'heart_rate': rng.normal(74, 8, n),
+        'blood_pressure_sys': rng.normal(122, 10, n) + hypertensive * 20,
+        'blood_pressure_dia': rng.normal(79, 6, n) + hypertensive * 10,
+        'oxygen_level': rng.normal(97.5, 0.8, n),
+        'temperature': rng.normal(36.8, 0.2, n),
+        'sugar_level': rng.normal(100, 12, n) + diabetic * 45,
+    }
+
+
+def day_of_readings(rng, args, patient_ids, profiles, day_start):
+    """Columns (timestamps, user_ids, vitals...) for one day of readings, in time order."""
+    slots = int(86400 // args.interval)
+    n = len(patient_ids) * slots
+    patient = np.repeat(np.arange(len(patient_ids)), slots)
+    ts = day_start + np.tile(np.arange(slots) * args.interval, len(patient_ids)) + rng.uniform(0, args.interval, n)
+    keep = rng.random(n) >= args.missing
+    patient, ts = patient[keep], ts[keep]
+    n = len(ts)
+
+    # Daily rhythm: heart rate and blood pressure peak in the afternoon
+    hour = (ts % 86400) / 3600
+    rhythm = np.sin((hour - 9) / 24 * 2 * np.pi)
+    abnormal = rng.random(n) < args.abnormal
+
+    heart_rate = profiles['heart_rate'][patient] + 6 * rhythm + rng.normal(0, 4, n) + abnormal * rng.normal(35, 10, n)
+    sys_bp = profiles['blood_pressure_sys'][patient] + 5 * rhythm + rng.normal(0, 6, n) + abnormal * rng.normal(25, 8, n)
+    dia_bp = profiles['blood_pressure_dia'][patient] + 3 * rhythm + rng.normal(0, 4, n) + abnormal * rng.normal(12, 5, n)
+    oxygen = profiles['oxygen_level'][patient] + rng.normal(0, 0.8, n) - abnormal * rng.uniform(0, 8, n)
+    temperature = profiles['temperature'][patient] + 0.2 * rhythm + rng.normal(0, 0.15, n) + abnormal * rng.uniform(0, 2, n)
+    sugar = profiles['sugar_level'][patient] + rng.normal(0, 10, n)
+
+    order = np.argsort(ts, kind='stable')
+    return (
+        ts[order].astype(np.int64),
+        patient_ids[patient[order]],
+        np.clip(np.rint(heart_rate[order]), 30, 220).astype(np.int64),
+        np.clip(np.rint(sys_bp[order]), 70, 240).astype(np.int64),
+        np.clip(np.rint(dia_bp[order]), 40, 150).astype(np.int64),
+        np.clip(np.rint(oxygen[order]), 70, 100).astype(np.int64),
+        np.round(np.clip(temperature[order], 34, 42), 1),
+        np.round(np.clip(sugar[order], 40, 450), 1),
+    )
+
+
+def insert_readings(conn, rng, args, patient_ids, start):
+    profiles = patient_profiles(rng, len(patient_ids))
+    total = 0
+    for day in range(args.days):
+        columns = day_of_readings(rng, args, patient_ids, profiles, start + day * 86400)
+        with conn:
+            conn.executemany(
+                "INSERT INTO health_data (timestamp, user_id, heart_rate, blood_pressure_sys, blood_pressure_dia, oxygen_level, temperature, sugar_level) "
+                "VALUES (datetime(?, 'unixepoch'), ?, ?, ?, ?, ?, ?, ?)",
+                zip(*(column.tolist() for column in columns))
+            )
+        total += len(columns[0])
+        print(f"[*] Day {day + 1}/{args.days}: {total} readings")
+    return total
+
+
+def insert_activity(conn, rng, args, patient_ids, pairs, start):
+    """Visit notes, medications, clinical info, doctor reminders and SOS alerts."""
+    seconds = args.days * 86400
+    visits = len(pairs) * max(1, args.days // 7)
+    pair_index = rng.integers(0, len(pairs), visits)
+    visit_ts = rng.integers(start, start + seconds, visits)
+    note_index = rng.integers(0, len(NOTES), visits)
+    conn.executemany(
+        "INSERT INTO visit_notes (patient_id, worker_id, note, timestamp) VALUES (?, ?, ?, datetime(?, 'unixepoch'))",
+        ((pairs[p][1], pairs[p][0], NOTES[k], t) for p, k, t in zip(pair_index.tolist(), note_index.tolist(), np.sort(visit_ts).tolist()))
+    )
+
+    medication_rows = []
+    medication_names = {}
+    for patient_id, count in zip(patient_ids.tolist(), rng.integers(0, 4, len(patient_ids)).tolist()):
+        names = []
+        for k in rng.choice(len(MEDICATIONS), count, replace=False).tolist():
+            name, dosage = MEDICATIONS[k]
+            names.append(name)
+            medication_rows.append((patient_id, name, dosage, f'{int(rng.integers(6, 22)):02d}:00', int(rng.random() < 0.5)))
+        medication_names[patient_id] = ', '.join(names)
+    conn.executemany("INSERT INTO medication_alerts (user_id, med_name, dosage, time, taken) VALUES (?, ?, ?, ?, ?)",
+                     medication_rows)
+
+    conn.executemany(
+        "INSERT INTO patient_clinical_info (patient_id, diseases, doctors, medications) VALUES (?, ?, ?, ?)",
+        ((patient_id, ', '.join(rng.choice(DISEASES, 2, replace=False).tolist()), f'Dr. Clinic {patient_id % 40}',
+          medication_names[patient_id])
+         for patient_id in patient_ids.tolist())
+    )
+    reminders = len(patient_ids) // 2
+    conn.executemany(
+        "INSERT INTO doctor_reminders (user_id, doctor_name, consultation_type, date, time) "
+        "VALUES (?, ?, 'Follow-up', date(?, 'unixepoch'), '10:00')",
+        zip(rng.choice(patient_ids, reminders).tolist(), (f'Dr. Clinic {k % 40}' for k in range(reminders)),
+            rng.integers(start + seconds, start + seconds + 30 * 86400, reminders).tolist())
+    )
+
+    # Roughly one SOS per patient per month; only the last few days' can still be active
+    sos = max(1, len(patient_ids) * args.days // 30)
+    sos_ts = np.sort(rng.integers(start, start + seconds, sos))
+    active = (sos_ts > start + seconds - 3 * 86400) & (rng.random(sos) < 0.3)
+    conn.executemany(
+        "INSERT INTO sos_alerts (patient_id, status, timestamp) VALUES (?, ?, datetime(?, 'unixepoch'))",
+        zip(rng.choice(patient_ids, sos).tolist(), np.where(active, 'active', 'dismissed').tolist(), sos_ts.tolist())
+    )
+    conn.commit()
+    return len(pair_index), len(medication_rows), sos
+
+
+def generate(args):
+    from passwords import hash_password
+    from rollups import rebuild_rollups
+    from vitals import rebuild_patient_latest
+
+    db.DB_PATH = os.path.abspath(args.db)
+    db.init_db()
+    conn = db.get_db_connection()
+    if conn.execute("SELECT 1 FROM users WHERE username_key = 'gen_patient0'").fetchone():
+        raise SystemExit(f"{db.DB_PATH} already contains a generated dataset; use a new file")
+    # A crash mid-load only loses a scratch database
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    end = int(time.time()) // 60 * 60
+    start = end - args.days * 86400
+
+    patient_ids, pairs = insert_users(conn, rng, args, hash_password(args.password))
+    conn.commit()
+    print(f"[*] {len(patient_ids)} patients, {len(pairs)} associations")
+    readings = insert_readings(conn, rng, args, patient_ids, start)
+    visits, medications, sos = insert_activity(conn, rng, args, patient_ids, pairs, start)
+    print(f"[*] {visits} visit notes, {medications} medication alerts, {sos} SOS alerts")
+
+    rebuild_patient_latest(conn)
+    rebuild_rollups(conn)
+    conn.commit()
+    conn.close()
+    print(f"Wrote {readings} readings to {db.DB_PATH} in {time.perf_counter() - started:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic HeaLink database for load testing.')
+    parser.add_argument('--db', required=True, help='SQLite file to create or extend (never the production one)')
+    parser.add_argument('--patients', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30, help='days of history, ending now')
+    parser.add_argument('--interval', type=float, default=300, help='seconds between a patient\'s readings')
+    parser.add_argument('--missing', type=float, default=0.02, help='fraction of readings dropped (device offline)')
+    parser.add_argument('--abnormal', type=float, default=0.01, help='fraction of readings with out-of-range vitals')
+    parser.add_argument('--password', default='patient123', help='password of every generated account')
+    parser.add_argument('--seed', type=int, default=1)
+    generate(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
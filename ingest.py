@@ -0,0 +1,173 @@
+import os
+import queue
+import threading
+import time
+import atexit
+from db import get_db_connection
+from vitals import insert_readings, publish_readings
+from app_logging import get_logger
+
+# Opt-in write-behind ingest for /api/update.
+#   HEALINK_INGEST_MODE        direct (default) | buffered
+#   HEALINK_INGEST_DURABILITY  commit (ack after the group commit, default) | enqueue (ack once queued)
+INGEST_MODE = os.environ.get('HEALINK_INGEST_MODE', 'direct')
+INGEST_DURABILITY = os.environ.get('HEALINK_INGEST_DURABILITY', 'commit')
+INGEST_QUEUE_SIZE = int(os.environ.get('HEALINK_INGEST_QUEUE_SIZE', 10000))
+INGEST_MAX_BATCH = int(os.environ.get('HEALINK_INGEST_MAX_BATCH', 500))
+INGEST_MAX_DELAY_MS = int(os.environ.get('HEALINK_INGEST_MAX_DELAY_MS', 50))
+INGEST_COMMIT_TIMEOUT = float(os.environ.get('HEALINK_INGEST_COMMIT_TIMEOUT', 5))
+INGEST_RETRY_AFTER = 1
+
+_STOP = object()
+
+log = get_logger('ingest')
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Pending:
+    __slots__ = ('rows', 'done', 'error')
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error = None
+
+
+class IngestBuffer:
+    """Bounded in-process queue drained by one writer thread that commits in groups.
+
+    A group closes when it holds max_batch rows or max_delay_ms after its first
+    reading arrived, whichever comes first.
+    """
+
+    def __init__(self, max_queue=INGEST_QUEUE_SIZE, max_batch=INGEST_MAX_BATCH, max_delay_ms=INGEST_MAX_DELAY_MS):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.committed_rows = 0
+        self.commits = 0
+        self.failed_rows = 0
+
+    def _ensure_writer(self):
+        # Started lazily so each gunicorn worker gets its own writer after fork
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='healink-ingest', daemon=True)
+                self._thread.start()
+
+    def submit(self, rows, wait=True, timeout=INGEST_COMMIT_TIMEOUT):
+        """Queue validated rows. Returns True once committed (or queued when wait=False),
+        False if the commit did not finish within timeout. Raises QueueFull on backpressure."""
+        self._ensure_writer()
+        pending = _Pending(rows)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            raise QueueFull()
+        if not wait:
+            return True
+        if not pending.done.wait(timeout):
+            return False
+        if pending.error is not None:
+            raise pending.error
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'queued': self.depth(),
+            'committed_rows': self.committed_rows,
+            'commits': self.commits,
+            'failed_rows': self.failed_rows
+        }
+
+    def _run(self):
+        conn = get_db_connection()
+        try:
+            stopping = False
+            while not stopping:
+                first = self._queue.get()
+                if first is _STOP:
+                    break
+                group = [first]
+                count = len(first.rows)
+                deadline = time.monotonic() + self.max_delay
+                while count < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    group.append(item)
+                    count += len(item.rows)
+                self._write(conn, group)
+        finally:
+            conn.close()
+
+    def _write(self, conn, group):
+        rows = [row for pending in group for row in pending.rows]
+        try:
+            insert_readings(conn, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Isolate the failing request instead of failing the whole group
+            for pending in group:
+                try:
+                    insert_readings(conn, pending.rows)
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    pending.error = e
+                    self.failed_rows += len(pending.rows)
+                    continue
+                self._committed(pending.rows)
+        else:
+            self._committed(rows)
+        for pending in group:
+            pending.done.set()
+
+    def _committed(self, rows):
+        self.commits += 1
+        self.committed_rows += len(rows)
+        # The rows are stored whatever happens here; a failure must not write them again
+        try:
+            publish_readings(rows)
+        except Exception:
+            log.exception('Publishing %d committed readings failed', len(rows))
+
+    def stop(self, timeout=INGEST_COMMIT_TIMEOUT):
+        """Drain whatever is queued and stop the writer."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+
+buffer = IngestBuffer()
+atexit.register(buffer.stop)
+
+
+def enabled():
+    return INGEST_MODE == 'buffered'
+
+
+def submit(rows):
+    return buffer.submit(rows, wait=INGEST_DURABILITY != 'enqueue')
@@ -1,16 +1,18 @@
 import sqlite3
 import os
+from db import init_db
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'data', 'health.db')
 
 def list_all_users():
+    init_db()
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
     try:
-        users = cursor.execute("SELECT id, username, role, password FROM users").fetchall()
+        users = cursor.execute("SELECT id, username, role, password FROM users ORDER BY username_key").fetchall()
         print(f"Total users: {len(users)}")
         print("-" * 60)
         for user in users:
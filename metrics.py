@@ -0,0 +1,193 @@
+import bisect
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from flask import request, g
+
+# Request and SQL metrics in Prometheus text format, served at /admin/metrics.
+# Recording is a few counter updates per request and per SQL statement; the text
+# is only built when something scrapes. HEALINK_METRICS=0 turns recording off.
+#
+# SQL statements are counted with sqlite3's trace callback on every connection
+# from db.get_db_connection(); SQL time covers execute()/executemany() and the
+# fetch*() calls, not rows pulled by iterating a cursor directly.
+METRICS_ENABLED = os.environ.get('HEALINK_METRICS', '1') != '0'
+METRICS_TOKEN = os.environ.get('HEALINK_METRICS_TOKEN')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class _Series:
+    __slots__ = ('buckets', 'count', 'sum', 'sql_statements', 'sql_seconds')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(_Series)
+        self._statuses = defaultdict(int)
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.readings = 0
+
+    def observe_request(self, endpoint, status, seconds, sql_statements, sql_seconds):
+        with self._lock:
+            series = self._endpoints[endpoint]
+            series.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            series.count += 1
+            series.sum += seconds
+            series.sql_statements += sql_statements
+            series.sql_seconds += sql_seconds
+            self._statuses[(endpoint, status)] += 1
+
+    def count_readings(self, n):
+        with self._lock:
+            self.readings += n
+
+    def render(self, extra=()):
+        """Prometheus text exposition of everything recorded, plus (name, type, help, value) extras."""
+        with self._lock:
+            endpoints = {name: (list(s.buckets), s.count, s.sum, s.sql_statements, s.sql_seconds)
+                         for name, s in self._endpoints.items()}
+            statuses = dict(self._statuses)
+            totals = (self.sql_statements, self.sql_seconds, self.readings)
+
+        lines = [
+            '# HELP healink_request_duration_seconds Time to produce the response, by Flask endpoint.',
+            '# TYPE healink_request_duration_seconds histogram',
+        ]
+        for name, (buckets, count, total, _, _) in sorted(endpoints.items()):
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += n
+                lines.append(f'healink_request_duration_seconds_bucket{{endpoint="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'healink_request_duration_seconds_sum{{endpoint="{name}"}} {total:.6f}')
+            lines.append(f'healink_request_duration_seconds_count{{endpoint="{name}"}} {count}')
+
+        lines += ['# HELP healink_requests_total Responses by endpoint and status code.',
+                  '# TYPE healink_requests_total counter']
+        lines += [f'healink_requests_total{{endpoint="{name}",status="{status}"}} {n}'
+                  for (name, status), n in sorted(statuses.items())]
+
+        lines += ['# HELP healink_request_sql_statements_total SQL statements run while handling requests.',
+                  '# TYPE healink_request_sql_statements_total counter']
+        lines += [f'healink_request_sql_statements_total{{endpoint="{name}"}} {v[3]}' for name, v in sorted(endpoints.items())]
+        lines += ['# HELP healink_request_sql_seconds_total SQL time spent while handling requests.',
+                  '# TYPE healink_request_sql_seconds_total counter']
+        lines += [f'healink_request_sql_seconds_total{{endpoint="{name}"}} {v[4]:.6f}' for name, v in sorted(endpoints.items())]
+
+        for name, kind, help_text, value in (
+            ('healink_sql_statements_total', 'counter', 'SQL statements on all connections, in or out of requests.', totals[0]),
+            ('healink_sql_seconds_total', 'counter', 'SQL time on all connections.', f'{totals[1]:.6f}'),
+            ('healink_readings_ingested_total', 'counter', 'Readings committed and published.', totals[2]),
+        ) + tuple(extra):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()
+
+
+def _add_sql(statements, seconds):
+    # Unlocked: worst case a lost increment under a race, never a wrong request total
+    registry.sql_statements += statements
+    registry.sql_seconds += seconds
+    current = getattr(_local, 'request', None)
+    if current is not None:
+        current[0] += statements
+        current[1] += seconds
+
+
+def _trace(statement):
+    _add_sql(1, 0.0)
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _add_sql(0, time.perf_counter() - started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _add_sql(0, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _add_sql(0, time.perf_counter() - started)
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            _add_sql(0, time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _add_sql(0, time.perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection whose shortcut execute methods go through TimedCursor."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+def connection_factory():
+    return TimedConnection if METRICS_ENABLED else sqlite3.Connection
+
+
+def instrument(conn):
+    if METRICS_ENABLED:
+        conn.set_trace_callback(_trace)
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    _local.request = [0, 0.0]
+
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    current = getattr(_local, 'request', None)
+    _local.request = None
+    if started is not None and current is not None:
+        registry.observe_request(request.endpoint or 'unmatched', response.status_code,
+                                time.perf_counter() - started, current[0], current[1])
+    return response
+
+
+def init_app(app):
+    if METRICS_ENABLED:
+        app.before_request(_before_request)
+        app.after_request(_after_request)
@@ -0,0 +1,377 @@
+import fcntl
+import os
+import sqlite3
+import sys
+from werkzeug.security import generate_password_hash
+from user_directory import username_key
+import db
+from rollups import create_rollup_tables, rebuild_rollups
+from vitals import rebuild_patient_latest
+
+# Ordered one-time schema and data migrations. Each runs in its own transaction
+# and is recorded in schema_migrations, so a worker starting against an
+# up-to-date database only reads the current version. Released migrations are
+# never edited; add a new one instead. The first ones are safe to run on
+# databases created by the old init_db(), which already have their tables.
+
+
+def _create_base_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS health_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            heart_rate INTEGER,
+            blood_pressure_sys INTEGER,
+            blood_pressure_dia INTEGER,
+            oxygen_level INTEGER,
+            temperature REAL,
+            sugar_level REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS medication_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            med_name TEXT,
+            dosage TEXT,
+            time TEXT,
+            taken INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visit_notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER,
+            worker_id INTEGER,
+            note TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (worker_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS hospitals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            address TEXT,
+            contact_person TEXT,
+            email TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sos_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER,
+            status TEXT DEFAULT 'active',
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT,
+            role TEXT,
+            full_name TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_associations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            monitor_id INTEGER,
+            patient_id INTEGER,
+            FOREIGN KEY (monitor_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patient_clinical_info (
+            patient_id INTEGER PRIMARY KEY,
+            diseases TEXT,
+            doctors TEXT,
+            medications TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS doctor_reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            doctor_name TEXT,
+            consultation_type TEXT,
+            date TEXT,
+            time TEXT,
+            status TEXT DEFAULT 'pending',
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clinical_rule_overrides (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER,
+            rule_id TEXT,
+            enabled INTEGER DEFAULT 1,
+            params TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (patient_id, rule_id),
+            FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Generation counters that let each worker detect stale in-memory caches
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def _seed_default_users(cursor):
+    default_users = [
+        ('admin', 'admin123', 'admin', 'System Administrator'),
+        ('patient', 'patient123', 'patient', 'Robert Johnson'),
+        ('worker', 'worker123', 'migrant_worker', 'Juan Garcia'),
+        ('nurse', 'nurse123', 'home_nurse', 'Sarah Smith'),
+        ('caregiver', 'caregiver123', 'caregiver', 'Emily Johnson')
+    ]
+
+    for username, password, role, full_name in default_users:
+        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+        if not cursor.fetchone():
+            pwd_hash = generate_password_hash(password)
+            cursor.execute("INSERT INTO users (username, password, role, full_name) VALUES (?, ?, ?, ?)", 
+                         (username, pwd_hash, role, full_name))
+
+
+def _reset_legacy_hashes(cursor):
+    # Fix legacy hashes for users added via older systems (e.g. PHP)
+    all_users = cursor.execute("SELECT id, username, password, role FROM users").fetchall()
+    
+    # Map roles to default fallback passwords ONLY if we must reset them
+    role_password_map = {
+        'admin': 'admin123',
+        'patient': 'patient123',
+        'migrant_worker': 'worker123',
+        'home_nurse': 'nurse123',
+        'caregiver': 'caregiver123'
+    }
+
+    for user in all_users:
+        # Check for PHP/BCrypt legacy hashes
+        if user['password'] and user['password'].startswith('$2y$'):
+            # Only reset if it's strictly necessary. 
+            # If the user is a known default account, we definitely reset it.
+            # If it's a new account, we use the role default but log a warning.
+            new_password = role_password_map.get(user['role'], 'healink123')
+            new_hash = generate_password_hash(new_password)
+            cursor.execute("UPDATE users SET password = ? WHERE id = ?", (new_hash, user['id']))
+            print(f"[*] Migrated legacy PHP hash for user: {user['username']} -> Reset to default {user['role']} password.")
+
+
+INDEXES = (
+    # History, latest reading and "last seen" per patient (MAX(timestamp) is one index probe)
+    "CREATE INDEX IF NOT EXISTS idx_health_data_user_time ON health_data (user_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_visit_notes_patient_time ON visit_notes (patient_id, timestamp)",
+    # Associations are looked up from both ends
+    "CREATE INDEX IF NOT EXISTS idx_user_associations_monitor ON user_associations (monitor_id, patient_id)",
+    "CREATE INDEX IF NOT EXISTS idx_user_associations_patient ON user_associations (patient_id, monitor_id)",
+    # Only active alerts are ever listed, so keep the index to those rows
+    "CREATE INDEX IF NOT EXISTS idx_sos_alerts_active ON sos_alerts (timestamp) WHERE status = 'active'",
+    "CREATE INDEX IF NOT EXISTS idx_sos_alerts_patient ON sos_alerts (patient_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (LOWER(username))",
+    "CREATE INDEX IF NOT EXISTS idx_users_role ON users (role, full_name)",
+    "CREATE INDEX IF NOT EXISTS idx_medication_alerts_user ON medication_alerts (user_id, taken, time)",
+    "CREATE INDEX IF NOT EXISTS idx_doctor_reminders_user ON doctor_reminders (user_id, status, date, time)",
+)
+
+
+def _create_indexes(cursor):
+    # Secondary indexes for every lookup the app makes (check_query_plans.py keeps
+    # the request SQL honest against them)
+    for statement in INDEXES:
+        cursor.execute(statement)
+
+
+def _create_rollups(cursor):
+    # Backfilled from existing readings when the tables are first created
+    if create_rollup_tables(cursor):
+        rebuild_rollups(cursor.connection)
+
+
+def _create_patient_latest(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patient_latest (
+            patient_id INTEGER PRIMARY KEY,
+            reading_id INTEGER NOT NULL,
+            timestamp DATETIME,
+            heart_rate INTEGER,
+            blood_pressure_sys INTEGER,
+            blood_pressure_dia INTEGER,
+            oxygen_level INTEGER,
+            temperature REAL,
+            sugar_level REAL
+        )
+    ''')
+    rebuild_patient_latest(cursor.connection)
+
+
+def _create_archive_partitions(cursor):
+    # Monthly archive files written by archive.py; archived_through is the
+    # exclusive upper bound of the timestamps already moved out of health_data
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_partitions (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            archived_through DATETIME NOT NULL,
+            readings INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def _add_username_key(cursor):
+    # Login matched LOWER(username); store the normalised name once and make it unique
+    cursor.execute("ALTER TABLE users ADD COLUMN username_key TEXT")
+    seen = {}
+    for user in cursor.execute("SELECT id, username FROM users ORDER BY id").fetchall():
+        if user['username'] is None:
+            continue
+        key = username_key(user['username'])
+        if key in seen:
+            # Left NULL (that account can't log in) rather than failing the migration
+            print(f"[!] Username {user['username']!r} (id {user['id']}) clashes with user id {seen[key]}; not keyed")
+            continue
+        seen[key] = user['id']
+        cursor.execute("UPDATE users SET username_key = ? WHERE id = ?", (key, user['id']))
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_key ON users (username_key)")
+    cursor.execute("DROP INDEX IF EXISTS idx_users_username_lower")
+
+
+def _create_user_search(cursor):
+    # Word-prefix index over names and usernames for the admin user search; the
+    # triggers keep it in step with every write to users, wherever it comes from
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5(
+            full_name, username, content='users', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_search_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_search (rowid, full_name, username) VALUES (new.id, new.full_name, new.username);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_search_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_search (users_search, rowid, full_name, username) VALUES ('delete', old.id, old.full_name, old.username);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_search_update AFTER UPDATE OF full_name, username ON users BEGIN
+            INSERT INTO users_search (users_search, rowid, full_name, username) VALUES ('delete', old.id, old.full_name, old.username);
+            INSERT INTO users_search (rowid, full_name, username) VALUES (new.id, new.full_name, new.username);
+        END
+    """)
+    cursor.execute("INSERT INTO users_search (users_search) VALUES ('rebuild')")
+    # Unfiltered search results and listings are ordered by name
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_full_name ON users (full_name)")
+
+
+MIGRATIONS = (
+    (1, 'base schema', _create_base_schema),
+    (2, 'seed default users', _seed_default_users),
+    (3, 'reset legacy PHP password hashes', _reset_legacy_hashes),
+    (4, 'secondary indexes', _create_indexes),
+    (5, 'time-series rollups', _create_rollups),
+    (6, 'patient_latest summary', _create_patient_latest),
+    (7, 'archive partitions', _create_archive_partitions),
+    (8, 'users.username_key', _add_username_key),
+    (9, 'user search index', _create_user_search),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    try:
+        return conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        # No schema_migrations table yet
+        return 0
+
+
+def _apply_pending(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    applied = []
+    version = current_version(conn)
+    for number, name, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            migration(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (number, name))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        print(f"[*] Applied migration {number}: {name}")
+        applied.append(number)
+    return applied
+
+
+def migrate():
+    """Apply pending migrations and return their numbers.
+
+    Only one process migrates at a time (file lock next to the database); the
+    others wait for it and then find nothing left to do.
+    """
+    os.makedirs(os.path.dirname(db.DB_PATH), exist_ok=True)
+
+    conn = db.get_db_connection()
+    try:
+        if current_version(conn) >= LATEST_VERSION:
+            return []
+        with open(db.DB_PATH + '.migrate.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Explicit transactions per migration; DDL must not be auto-committed halfway
+            conn.isolation_level = None
+            # WAL is persistent in the database file, so setting it once here covers every worker
+            conn.execute("PRAGMA journal_mode = WAL")
+            return _apply_pending(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    conn = db.get_db_connection()
+    before = current_version(conn)
+    conn.close()
+    if '--status' in sys.argv:
+        print(f"Schema version {before} of {LATEST_VERSION}")
+        for number, name, _ in MIGRATIONS:
+            print(f"  {'applied' if number <= before else 'pending'}  {number}: {name}")
+    else:
+        migrate()
+        print("Database is at schema version", LATEST_VERSION)
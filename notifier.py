@@ -0,0 +1,144 @@
+import os
+import socket
+import tempfile
+import threading
+import hashlib
+import atexit
+from collections import defaultdict
+import db
+
+# Cross-process change notifications.
+#
+# Every process that has subscribers binds a Unix datagram socket named after its
+# pid inside a directory shared by all workers of the same database. publish()
+# delivers to local handlers directly and sends one datagram "<channel>:<key>" to
+# every other socket in that directory. Messages are best-effort wake-up signals;
+# consumers must still read the real state from the database.
+
+NOTIFY_DIR = os.environ.get('HEALINK_NOTIFY_DIR')
+_MAX_MESSAGE = 512
+
+
+def _notify_dir():
+    if NOTIFY_DIR:
+        return NOTIFY_DIR
+    digest = hashlib.sha1(os.path.abspath(db.DB_PATH).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'healink-notify-{digest}')
+
+
+class Notifier:
+    def __init__(self):
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._dir = None
+        self._path = None
+        self._recv_sock = None
+        self._send_sock = None
+
+    def subscribe(self, channel, handler):
+        """Call handler(key) for every publish on channel, from this or any other process."""
+        with self._lock:
+            self._handlers[channel].append(handler)
+
+    def listen(self):
+        """Bind this process's socket so publishes from other workers reach it."""
+        if self._pid == os.getpid() and self._recv_sock is not None:
+            return
+        if not hasattr(socket, 'AF_UNIX'):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._recv_sock is not None:
+                return
+            self._reset()
+            directory = _notify_dir()
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            path = os.path.join(directory, f'{os.getpid()}.sock')
+            if os.path.exists(path):
+                # Left behind by a crashed process that had our pid
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            self._dir, self._path, self._recv_sock = directory, path, sock
+            threading.Thread(target=self._recv_loop, args=(sock,), name='healink-notify', daemon=True).start()
+
+    def _reset(self):
+        # After a fork the inherited sockets belong to the parent
+        self._pid = os.getpid()
+        self._dir = self._path = self._recv_sock = None
+        self._send_sock = None
+
+    def publish(self, channel, key):
+        message = f'{channel}:{key}'
+        self._dispatch(message)
+        self._broadcast(message.encode())
+
+    def _dispatch(self, message):
+        channel, _, key = message.partition(':')
+        for handler in list(self._handlers.get(channel, ())):
+            try:
+                handler(key)
+            except Exception:
+                pass
+
+    def _broadcast(self, payload):
+        if not hasattr(socket, 'AF_UNIX'):
+            return
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        directory = self._dir or _notify_dir()
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        if self._send_sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self._send_sock = sock
+        for name in names:
+            if not name.endswith('.sock'):
+                continue
+            path = os.path.join(directory, name)
+            if path == self._path:
+                continue
+            try:
+                self._send_sock.sendto(payload, path)
+            except ConnectionRefusedError:
+                # Nobody is bound any more: the worker exited without cleaning up
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                # Full receive buffer or a race with a worker shutting down; the
+                # consumer's periodic re-check covers a dropped wake-up
+                pass
+
+    def _recv_loop(self, sock):
+        while True:
+            try:
+                payload = sock.recv(_MAX_MESSAGE)
+            except OSError:
+                return
+            self._dispatch(payload.decode(errors='replace'))
+
+    def close(self):
+        if self._pid == os.getpid() and self._path:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+
+
+notifier = Notifier()
+atexit.register(notifier.close)
+
+
+def publish(channel, key):
+    notifier.publish(channel, key)
+
+
+def subscribe(channel, handler):
+    notifier.subscribe(channel, handler)
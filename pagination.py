@@ -0,0 +1,33 @@
+import base64
+import binascii
+import json
+
+# Keyset pagination helpers. A cursor is the opaque, URL-safe encoding of the
+# sort key of the last row on a page; the next page is "rows strictly after that
+# key" in the list's order, so every page costs one index range read however deep
+# the client has scrolled.
+
+PAGE_SIZE = 25
+
+
+def encode_cursor(*key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    """Return the key tuple of an encode_cursor() value with `size` parts; raise ValueError otherwise."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list) or len(key) != size or not all(isinstance(k, (str, int)) for k in key):
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+
+def split_page(rows, limit, key):
+    """Trim a result fetched with LIMIT limit + 1 to (rows, next_cursor or None)."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
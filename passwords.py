@@ -0,0 +1,164 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing off the request threads. check_password_hash is deliberately
+# slow (hundreds of milliseconds of CPU), so a burst of logins would otherwise hold
+# every worker thread; here it runs in a small process pool with a bounded number
+# of waiting requests. Stored hashes whose parameters differ from PASSWORD_METHOD
+# are replaced on the next successful login, so the cost can be retuned without
+# resetting anyone's password.
+#   HEALINK_PASSWORD_METHOD       werkzeug method string (default scrypt:32768:8:1)
+#   HEALINK_PASSWORD_POOL_SIZE    worker processes; 0 hashes inline on the request thread
+#   HEALINK_PASSWORD_QUEUE_LIMIT  verifications in flight before logins get a 503
+PASSWORD_METHOD = os.environ.get('HEALINK_PASSWORD_METHOD', 'scrypt:32768:8:1')
+PASSWORD_POOL_SIZE = int(os.environ.get('HEALINK_PASSWORD_POOL_SIZE', min(4, os.cpu_count() or 1)))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get('HEALINK_PASSWORD_QUEUE_LIMIT', 32))
+PASSWORD_TIMEOUT = float(os.environ.get('HEALINK_PASSWORD_TIMEOUT', 10))
+PASSWORD_RETRY_AFTER = 1
+
+
+class PoolBusy(Exception):
+    pass
+
+
+def hash_password(password):
+    return generate_password_hash(password, PASSWORD_METHOD)
+
+
+_policy_prefix = None
+
+
+def needs_rehash(stored_hash):
+    """True if stored_hash was made with other parameters than PASSWORD_METHOD."""
+    global _policy_prefix
+    if _policy_prefix is None:
+        # werkzeug fills in defaults (pbkdf2 -> pbkdf2:sha256:1000000); learn the full form once
+        _policy_prefix = hash_password('').split('$', 1)[0]
+    return stored_hash.split('$', 1)[0] != _policy_prefix
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    return func(*args), time.perf_counter() - started
+
+
+class PasswordPool:
+    def __init__(self, size=PASSWORD_POOL_SIZE, queue_limit=PASSWORD_QUEUE_LIMIT, timeout=PASSWORD_TIMEOUT):
+        self.size = size
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _ensure_executor(self):
+        # Created lazily so each gunicorn worker gets its own pool after fork. The
+        # workers come from a forkserver rather than a fork of this (threaded) process
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ProcessPoolExecutor(max_workers=self.size,
+                                                     mp_context=multiprocessing.get_context('forkserver'))
+        return self._executor
+
+    def shutdown(self):
+        """Stop this process's worker processes; the next password check starts a new pool."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            owned = self._pid == os.getpid()
+        if executor is not None and owned:
+            executor.shutdown(wait=True)
+
+    def _run(self, func, *args):
+        if self.size <= 0:
+            result, elapsed = _timed(func, *args)
+            with self._lock:
+                self.completed += 1
+                self.hash_seconds += elapsed
+            return result
+
+        with self._lock:
+            if self._in_flight >= self.queue_limit:
+                self.rejected += 1
+                raise PoolBusy('Too many logins in progress, retry shortly')
+            self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            future = self._ensure_executor().submit(_timed, func, *args)
+            try:
+                result, elapsed = future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolBusy('Password check timed out, retry shortly')
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        wait = time.perf_counter() - started - elapsed
+        with self._lock:
+            self.completed += 1
+            self.hash_seconds += elapsed
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        return result
+
+    def verify(self, stored_hash, password):
+        return self._run(check_password_hash, stored_hash, password)
+
+    def hash(self, password):
+        return self._run(hash_password, password)
+
+    def stats(self):
+        completed = self.completed or 1
+        return {
+            'workers': self.size,
+            'in_flight': self._in_flight,
+            'queue_limit': self.queue_limit,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'rehashed': self.rehashed,
+            'avg_hash_ms': round(self.hash_seconds / completed * 1000, 1),
+            'avg_wait_ms': round(self.wait_seconds / completed * 1000, 1),
+            'max_wait_ms': round(self.max_wait_seconds * 1000, 1)
+        }
+
+
+password_pool = PasswordPool()
+atexit.register(password_pool.shutdown)
+
+
+def verify_and_upgrade(conn, user, password):
+    """Check password against the user's row; on success, store a hash made with the
+    current PASSWORD_METHOD if the old one used other parameters. Raises PoolBusy
+    only if the check itself could not run.
+    """
+    if not password_pool.verify(user['password'], password):
+        return False
+    if needs_rehash(user['password']):
+        try:
+            new_hash = password_pool.hash(password)
+        except PoolBusy:
+            # The password was right; the next login retries the upgrade
+            return True
+        # Skip if the hash changed meanwhile (another login upgraded it, or a reset)
+        conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?", (new_hash, user['id'], user['password']))
+        conn.commit()
+        password_pool.rehashed += 1
+    return True
@@ -0,0 +1,23 @@
+import time
+from db import init_db, get_db_connection
+from rollups import rebuild_rollups
+from vitals import rebuild_patient_latest
+
+# Recomputes the tables derived from health_data (patient_latest and the
+# minute/hour/day rollups). The app keeps them current on every insert; run this
+# after loading or deleting readings directly in the database.
+
+def rebuild_summaries():
+    init_db()
+    conn = get_db_connection()
+    started = time.perf_counter()
+    rebuild_patient_latest(conn)
+    print(f"[*] patient_latest: {conn.execute('SELECT COUNT(*) FROM patient_latest').fetchone()[0]} patients")
+    rebuild_rollups(conn)
+    print(f"[*] rollups: {conn.execute('SELECT COUNT(*) FROM health_rollup_minute').fetchone()[0]} minute buckets")
+    conn.commit()
+    conn.close()
+    print(f"Rebuilt in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    rebuild_summaries()
@@ -0,0 +1,51 @@
+import threading
+import time
+from db import get_db, get_generation
+import notifier
+
+# Base for the per-process copies of shared tables (association index, rule
+# engine, active SOS alerts). A write bumps the copy's row in cache_generations
+# and publishes on its notifier channel, whose subscriber is mark_stale(); the
+# next read in each worker reloads once. The version is also re-checked every
+# RELOAD_INTERVAL seconds in case a wake-up was missed.
+
+
+class Reloadable:
+    """Subclasses set GENERATION (and RELOAD_INTERVAL), implement _load(conn, version)
+    which must set self._version, and call _ensure_fresh() before every read.
+    """
+
+    GENERATION = None
+    RELOAD_INTERVAL = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0.0
+        self._stale = True
+
+    def mark_stale(self, key=None):
+        self._stale = True
+
+    def _current_version(self, conn):
+        return get_generation(conn, self.GENERATION)
+
+    def _load(self, conn, version):
+        raise NotImplementedError
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if not self._stale and now - self._checked < self.RELOAD_INTERVAL:
+            return
+        with self._lock:
+            if not self._stale and now - self._checked < self.RELOAD_INTERVAL:
+                return
+            notifier.notifier.listen()
+            self._stale = False
+            self._checked = now
+            conn = get_db()
+            # Read the version before the rows: a change committed in between
+            # only makes the next check reload once more
+            version = self._current_version(conn)
+            if version != self._version:
+                self._load(conn, version)
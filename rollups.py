@@ -0,0 +1,188 @@
+from datetime import datetime, timezone
+from db import READING_FIELDS
+from archive import reading_sources
+
+# Per-minute, per-hour and per-day aggregates of health_data. insert_readings()
+# folds every new batch into all three tiers inside the writer's transaction, so
+# a long-range chart reads a bounded number of rows however many raw readings
+# exist. A vital stored as 0 means "not measured" and is left out of the
+# aggregates, like the alert rules do.
+
+ROLLUP_TIERS = {
+    'minute': (60, '%Y-%m-%d %H:%M:00'),
+    'hour': (3600, '%Y-%m-%d %H:00:00'),
+    'day': (86400, '%Y-%m-%d 00:00:00'),
+}
+RESOLUTIONS = ('raw',) + tuple(ROLLUP_TIERS) + ('auto',)
+
+HISTORY_LIMIT = 50
+HISTORY_MAX_POINTS = 500
+
+
+def _table(tier):
+    return f"health_rollup_{tier}"
+
+
+_AGGREGATES = ', '.join(
+    f"COUNT(NULLIF({f}, 0)), TOTAL(NULLIF({f}, 0)), MIN(NULLIF({f}, 0)), MAX(NULLIF({f}, 0))"
+    for f in READING_FIELDS
+)
+_COLUMNS = ', '.join(f"{f}_n, {f}_sum, {f}_min, {f}_max" for f in READING_FIELDS)
+_MERGE = ', '.join(
+    f"{f}_n = {f}_n + excluded.{f}_n, "
+    f"{f}_sum = {f}_sum + excluded.{f}_sum, "
+    f"{f}_min = CASE WHEN {f}_min IS NULL OR excluded.{f}_min < {f}_min THEN excluded.{f}_min ELSE {f}_min END, "
+    f"{f}_max = CASE WHEN {f}_max IS NULL OR excluded.{f}_max > {f}_max THEN excluded.{f}_max ELSE {f}_max END"
+    for f in READING_FIELDS
+)
+
+
+def _upsert_sql(tier, table='health_data', where='id BETWEEN ? AND ?'):
+    _, fmt = ROLLUP_TIERS[tier]
+    return f"""
+        INSERT INTO {_table(tier)} (user_id, bucket, samples, {_COLUMNS})
+        SELECT user_id, strftime('{fmt}', timestamp), COUNT(*), {_AGGREGATES}
+        FROM {table}
+        WHERE {where}
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, bucket) DO UPDATE SET samples = samples + excluded.samples, {_MERGE}
+    """
+
+
+_UPSERT_SQL = {tier: _upsert_sql(tier) for tier in ROLLUP_TIERS}
+
+_READ_COLUMNS = ', '.join(
+    f"CASE WHEN {f}_n THEN ROUND({f}_sum / {f}_n, 2) ELSE 0 END AS {f}, {f}_min, {f}_max"
+    for f in READING_FIELDS
+)
+
+
+def create_rollup_tables(cursor):
+    """Create the tier tables; returns True if any of them did not exist yet."""
+    created = False
+    for tier in ROLLUP_TIERS:
+        exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (_table(tier),)).fetchone()
+        created = created or not exists
+        stats = ', '.join(
+            f"{f}_n INTEGER NOT NULL DEFAULT 0, {f}_sum REAL NOT NULL DEFAULT 0, {f}_min REAL, {f}_max REAL"
+            for f in READING_FIELDS
+        )
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {_table(tier)} (
+                user_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                samples INTEGER NOT NULL DEFAULT 0,
+                {stats},
+                PRIMARY KEY (user_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+    return created
+
+
+def update_rollups(conn, first_id, last_id):
+    """Fold the health_data rows with ids first_id..last_id into every tier."""
+    for sql in _UPSERT_SQL.values():
+        conn.execute(sql, (first_id, last_id))
+
+
+def rebuild_rollups(conn):
+    """Recompute every tier from health_data and its archive partitions (after bulk
+    loads or deletes). The caller commits; archived months are committed as they go.
+    """
+    for tier in ROLLUP_TIERS:
+        conn.execute(f"DELETE FROM {_table(tier)}")
+    for table, where, params in reading_sources(conn):
+        for tier in ROLLUP_TIERS:
+            conn.execute(_upsert_sql(tier, table, where or '1'), params)
+        if where:
+            # The partition can only be detached outside a transaction
+            conn.commit()
+
+
+def parse_time(value):
+    """Normalise an ISO date/time to the UTC 'YYYY-MM-DD HH:MM:SS' form health_data stores."""
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _span_seconds(start, end):
+    return (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds()
+
+
+def choose_resolution(conn, user_id, start, end, max_points=HISTORY_MAX_POINTS):
+    """Finest resolution that covers start..end in at most max_points rows."""
+    span = _span_seconds(start, end)
+    for tier, (seconds, _) in ROLLUP_TIERS.items():
+        if span / seconds > max_points:
+            continue
+        if tier == 'minute':
+            # The minute tier knows the raw row count without touching health_data
+            raw = conn.execute(f"""
+                SELECT TOTAL(samples) FROM {_table(tier)}
+                WHERE user_id = ? AND bucket >= strftime('%Y-%m-%d %H:%M:00', ?) AND bucket < ?
+            """, (user_id, start, end)).fetchone()[0]
+            if raw <= max_points:
+                return 'raw'
+        return tier
+    return 'day'
+
+
+def read_history(conn, user_id, resolution='raw', start=None, end=None, limit=HISTORY_LIMIT, before=None):
+    """Readings or tier buckets for one patient, oldest first: the newest `limit` of them.
+
+    before is the (timestamp, id) key of a row from a previous page; only older
+    rows are returned. Also returns the key to pass as before for the next older
+    page, or None when there is nothing older.
+    """
+    where = ['user_id = ?']
+    params = [user_id]
+    if resolution == 'raw':
+        if start:
+            where.append('timestamp >= ?')
+            params.append(start)
+        if end:
+            where.append('timestamp < ?')
+            params.append(end)
+        if before:
+            where.append('(timestamp, id) < (?, ?)')
+            params.extend(before)
+        # Newest source first; archive months only matter while they can still
+        # hold rows newer than the oldest one collected so far
+        rows = []
+        for table, source_where, source_params in reading_sources(conn, start, end, newest_first=True):
+            if len(rows) > limit and source_where and rows[-1]['timestamp'] >= source_params[0]:
+                # Everything in this and older months is older than the page already is
+                break
+            rows.extend(conn.execute(f"""
+                SELECT * FROM {table} WHERE {' AND '.join(where + ([source_where] if source_where else []))}
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            """, params + source_params + [limit + 1]).fetchall())
+            rows.sort(key=lambda row: (row['timestamp'], row['id']), reverse=True)
+            del rows[limit + 1:]
+    else:
+        _, fmt = ROLLUP_TIERS[resolution]
+        if start:
+            where.append(f"bucket >= strftime('{fmt}', ?)")
+            params.append(start)
+        if end:
+            where.append('bucket < ?')
+            params.append(end)
+        if before:
+            where.append('bucket < ?')
+            params.append(before[0])
+        rows = conn.execute(f"""
+            SELECT user_id, bucket AS timestamp, samples, {_READ_COLUMNS}
+            FROM {_table(resolution)} WHERE {' AND '.join(where)}
+            ORDER BY bucket DESC LIMIT ?
+        """, params + [limit + 1]).fetchall()
+
+    next_before = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_before = (rows[-1]['timestamp'], rows[-1]['id'] if resolution == 'raw' else 0)
+    return [dict(row) for row in reversed(rows)], next_before
@@ -1,67 +1,145 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from db import get_db_connection
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, Response
+from db import get_db
+from pagination import PAGE_SIZE, decode_cursor, split_page
+from clinical import clinical_cache
+from rules import rule_engine, rules_changed, publish_rules_changed, validate_override
+from associations import association_index, associations_changed, publish_associations_changed
+from alert_scan import scan as scan_alerts, SCAN_MAX_EPISODES, SCAN_MAX_GAP
+from rollups import parse_time
+import json
+from routes_api import vitals_hub
+from sos import active_sos, sos_changed, publish_sos_changed
+import ingest
+import app_logging
+import metrics
 from auth_utils import roles_required
-from werkzeug.security import generate_password_hash
+from passwords import password_pool
+from user_directory import username_key, user_cache, invalidate_user, search_users, SEARCH_LIMIT, SEARCH_MAX_LIMIT
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+def users_page(conn, cursor=None):
+    after = decode_cursor(cursor, 1)[0] if cursor else 0
+    rows = conn.execute("SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?", (after, PAGE_SIZE + 1)).fetchall()
+    return split_page(rows, PAGE_SIZE, lambda row: (row['id'],))
+
+def hospitals_page(conn, cursor=None):
+    after = decode_cursor(cursor, 1)[0] if cursor else 0
+    rows = conn.execute("SELECT * FROM hospitals WHERE id > ? ORDER BY id LIMIT ?", (after, PAGE_SIZE + 1)).fetchall()
+    return split_page(rows, PAGE_SIZE, lambda row: (row['id'],))
+
+def _rows_fragment(template, page, cursor, **context):
+    # Next page of an admin table as <tr> rows, for infinite scroll
+    try:
+        rows, next_cursor = page(get_db(), cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = Response(render_template(template, rows=rows, **context))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def _search_roles():
+    # ?role=patient&role=caregiver or ?role=patient,caregiver
+    return [r for value in request.args.getlist('role') for r in value.split(',') if r.strip()]
+
+@admin_bp.route('/users')
+@roles_required('admin')
+def users():
+    query = request.args.get('q', '')
+    roles = _search_roles()
+    if query.strip() or roles:
+        # Filtered from the search box: name order instead of id order
+        page = lambda conn, cursor: search_users(conn, query, roles, PAGE_SIZE, cursor)
+    else:
+        page = users_page
+    return _rows_fragment('partials/admin_user_rows.html', page, request.args.get('cursor'))
+
+@admin_bp.route('/user_search')
+@roles_required('admin')
+def user_search():
+    """Typeahead over users: ?q= matches word prefixes of the name or username,
+    role= narrows it (repeatable or comma-separated); pages via X-Next-Cursor.
+    """
+    limit = min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 1), SEARCH_MAX_LIMIT)
+    try:
+        rows, next_cursor = search_users(get_db(), request.args.get('q', ''), _search_roles(), limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify([dict(row) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@admin_bp.route('/hospitals')
+@roles_required('admin')
+def hospitals():
+    return _rows_fragment('partials/admin_hospital_rows.html', hospitals_page, request.args.get('cursor'))
+
 @admin_bp.route('/')
 @roles_required('admin')
 def index():
     view_user_id = request.args.get('user_id')
-    conn = get_db_connection()
-    
-    patients = conn.execute("SELECT id, full_name, role FROM users WHERE role = 'patient'").fetchall()
-    active_sos = conn.execute("SELECT s.*, u.full_name FROM sos_alerts s JOIN users u ON s.patient_id = u.id WHERE s.status = 'active' ORDER BY s.timestamp DESC").fetchall()
-    hospitals = conn.execute("SELECT * FROM hospitals").fetchall()
-    all_users = conn.execute("SELECT * FROM users").fetchall()
+    conn = get_db()
     
-    # Association dropdowns
-    monitors = conn.execute("SELECT id, username, role FROM users WHERE role IN ('home_nurse', 'caregiver', 'migrant_worker')").fetchall()
-    
-    conn.close()
+    patient_count = conn.execute("SELECT COUNT(*) FROM users WHERE role = 'patient'").fetchone()[0]
+    hospitals, hospitals_cursor = hospitals_page(conn)
+    all_users, users_cursor = users_page(conn)
+    user_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
     
     clinical_info = None
     medication_alerts = []
+    rule_overrides = []
     if view_user_id:
         # Fetching extra data for monitoring view
-        conn = get_db_connection()
         clinical_info = conn.execute("SELECT * FROM patient_clinical_info WHERE patient_id = ?", (view_user_id,)).fetchone()
         medication_alerts = conn.execute("SELECT * FROM medication_alerts WHERE user_id = ? ORDER BY time ASC", (view_user_id,)).fetchall()
-        conn.close()
+        rule_overrides = conn.execute("SELECT * FROM clinical_rule_overrides WHERE patient_id = ? ORDER BY rule_id", (view_user_id,)).fetchall()
 
     return render_template('admin/index.html', 
-                           patients=patients, 
-                           active_sos=active_sos, 
+                           patient_count=patient_count, 
+                           active_sos=active_sos.snapshot()[1], 
                            hospitals=hospitals, 
+                           hospitals_cursor=hospitals_cursor,
                            all_users=all_users,
-                           monitors=monitors,
+                           users_cursor=users_cursor,
+                           user_count=user_count,
                            view_user_id=view_user_id,
                            clinical_info=clinical_info,
-                           medication_alerts=medication_alerts)
+                           medication_alerts=medication_alerts,
+                           rule_definitions=rule_engine.base_rules(),
+                           rule_overrides=rule_overrides)
 
 @admin_bp.route('/action', methods=['POST'])
 @roles_required('admin')
 def action():
     action_type = request.form.get('action')
-    conn = get_db_connection()
+    conn = get_db()
     
     try:
         if action_type == 'add_user':
-            username = request.form['username']
-            password = generate_password_hash(request.form['password'])
+            username = request.form['username'].strip()
+            password = password_pool.hash(request.form['password'])
             role = request.form['role']
             full_name = request.form['full_name']
-            conn.execute("INSERT INTO users (username, password, role, full_name) VALUES (?, ?, ?, ?)", (username, password, role, full_name))
+            conn.execute("INSERT INTO users (username, username_key, password, role, full_name) VALUES (?, ?, ?, ?, ?)",
+                         (username, username_key(username), password, role, full_name))
         
         elif action_type == 'add_association':
             conn.execute("INSERT INTO user_associations (monitor_id, patient_id) VALUES (?, ?)", (request.form['monitor_id'], request.form['patient_id']))
+            associations_changed(conn)
             
         elif action_type == 'delete_user':
             conn.execute("DELETE FROM users WHERE id = ?", (request.form['id'],))
+            # The schema's ON DELETE CASCADE only applies with PRAGMA foreign_keys on
+            conn.execute("DELETE FROM user_associations WHERE monitor_id = ? OR patient_id = ?", (request.form['id'], request.form['id']))
+            associations_changed(conn)
+            # Their active SOS alerts drop out of the joined set
+            sos_changed(conn)
             
         elif action_type == 'delete_association':
             conn.execute("DELETE FROM user_associations WHERE id = ?", (request.form['id'],))
+            associations_changed(conn)
             
         elif action_type == 'add_med':
             conn.execute("INSERT INTO medication_alerts (user_id, med_name, dosage, time) VALUES (?, ?, ?, ?)", 
@@ -73,19 +151,42 @@ def action():
             
         elif action_type == 'dismiss_sos':
             conn.execute("UPDATE sos_alerts SET status = 'dismissed' WHERE id = ?", (request.form['sos_id'],))
+            sos_changed(conn)
+
+        elif action_type == 'set_rule_override':
+            rule_id = request.form['rule_id'].strip()
+            enabled = 1 if request.form.get('enabled') else 0
+            params = json.loads(request.form.get('params') or '{}')
+            validate_override(rule_id, enabled, params)
+            conn.execute("""
+                INSERT INTO clinical_rule_overrides (patient_id, rule_id, enabled, params) VALUES (?, ?, ?, ?)
+                ON CONFLICT(patient_id, rule_id) DO UPDATE SET enabled = excluded.enabled, params = excluded.params, updated_at = CURRENT_TIMESTAMP
+            """, (request.form['patient_id'], rule_id, enabled, json.dumps(params)))
+            rules_changed(conn)
+
+        elif action_type == 'delete_rule_override':
+            conn.execute("DELETE FROM clinical_rule_overrides WHERE id = ?", (request.form['id'],))
+            rules_changed(conn)
             
         conn.commit()
+        if action_type in ('set_rule_override', 'delete_rule_override'):
+            publish_rules_changed()
+        if action_type in ('add_association', 'delete_user', 'delete_association'):
+            publish_associations_changed()
+        if action_type in ('dismiss_sos', 'delete_user'):
+            publish_sos_changed()
+        if action_type == 'delete_user':
+            invalidate_user(request.form['id'])
     except Exception as e:
+        conn.rollback()
         flash(f"Error: {str(e)}")
-    finally:
-        conn.close()
         
     return redirect(request.referrer or url_for('admin.index'))
 
 @admin_bp.route('/relationships')
 @roles_required('admin')
 def relationships():
-    conn = get_db_connection()
+    conn = get_db()
     
     # Fetch all associations with details
     associations = conn.execute("""
@@ -98,51 +199,86 @@ def relationships():
         ORDER BY m.full_name ASC
     """).fetchall()
     
-    # Data for the add form
-    patients = conn.execute("SELECT id, full_name FROM users WHERE role = 'patient'").fetchall()
-    monitors = conn.execute("SELECT id, full_name, role FROM users WHERE role IN ('home_nurse', 'caregiver', 'migrant_worker')").fetchall()
-    
-    conn.close()
-    return render_template('admin/relationships.html', 
-                           associations=associations,
-                           patients=patients,
-                           monitors=monitors)
+    return render_template('admin/relationships.html', associations=associations)
 
 @admin_bp.route('/migrant_workers')
 @roles_required('admin')
 def migrant_workers():
-    conn = get_db_connection()
-    workers = conn.execute("""
-        SELECT u.id, u.full_name, u.username, 
-        (SELECT COUNT(*) FROM user_associations WHERE monitor_id = u.id) as patient_count
-        FROM users u
-        WHERE u.role = 'migrant_worker'
-    """).fetchall()
-    conn.close()
+    conn = get_db()
+    workers = [
+        dict(row, patient_count=len(association_index.patients_of(row['id'])))
+        for row in conn.execute("SELECT id, full_name, username FROM users WHERE role = 'migrant_worker'")
+    ]
     return render_template('admin/migrant_workers.html', workers=workers)
 
 @admin_bp.route('/caregivers')
 @roles_required('admin')
 def caregivers():
-    conn = get_db_connection()
-    caregivers = conn.execute("""
-        SELECT u.id, u.full_name, u.username, 
-        (SELECT COUNT(*) FROM user_associations WHERE monitor_id = u.id) as patient_count
-        FROM users u
-        WHERE u.role = 'caregiver'
-    """).fetchall()
-    conn.close()
+    conn = get_db()
+    caregivers = [
+        dict(row, patient_count=len(association_index.patients_of(row['id'])))
+        for row in conn.execute("SELECT id, full_name, username FROM users WHERE role = 'caregiver'")
+    ]
     return render_template('admin/caregivers.html', caregivers=caregivers)
 
 @admin_bp.route('/patients')
 @roles_required('admin')
 def patients_list():
-    conn = get_db_connection()
-    patients = conn.execute("""
-        SELECT u.id, u.full_name, u.username, 
-        (SELECT COUNT(*) FROM user_associations WHERE patient_id = u.id) as monitor_count
-        FROM users u
-        WHERE u.role = 'patient'
-    """).fetchall()
-    conn.close()
+    conn = get_db()
+    patients = [
+        dict(row, monitor_count=len(association_index.monitors_of(row['id'])))
+        for row in conn.execute("SELECT id, full_name, username FROM users WHERE role = 'patient'")
+    ]
     return render_template('admin/patients.html', patients=patients)
+
+@admin_bp.route('/alert_scan', methods=['GET', 'POST'])
+@roles_required('admin')
+def alert_scan():
+    # Query string or JSON body: patient_ids=2,3 (default: everyone), from, to, max_episodes,
+    # max_gap (seconds); a JSON body may also carry "rules" to audit candidate thresholds
+    body = request.get_json(silent=True) or {}
+    params = request.args.to_dict()
+    params.update({k: v for k, v in body.items() if k != 'rules'})
+    try:
+        patient_ids = [int(x) for x in str(params.get('patient_ids') or params.get('patient_id') or '').split(',') if x.strip()]
+        start = parse_time(params['from']) if params.get('from') else None
+        end = parse_time(params['to']) if params.get('to') else None
+        result = scan_alerts(get_db(), patient_ids or None, start, end,
+                             rules=body.get('rules'), max_episodes=int(params.get('max_episodes', SCAN_MAX_EPISODES)),
+                             max_gap=float(params.get('max_gap', SCAN_MAX_GAP)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+@admin_bp.route('/metrics')
+def metrics_text():
+    # Prometheus scrape target: an admin session, or the HEALINK_METRICS_TOKEN bearer token
+    token = metrics.METRICS_TOKEN
+    if session.get('role') != 'admin' and not (token and request.headers.get('Authorization') == f'Bearer {token}'):
+        return Response(status=403)
+    streams = vitals_hub.stats()
+    ingest_stats = ingest.buffer.stats()
+    text = metrics.registry.render((
+        ('healink_sse_viewers', 'gauge', 'Open vitals stream connections.', streams['viewers']),
+        ('healink_sse_patients', 'gauge', 'Patients with at least one open vitals stream.', streams['patients']),
+        ('healink_sos_active', 'gauge', 'Active SOS alerts.', len(active_sos.snapshot()[1])),
+        ('healink_ingest_queue_depth', 'gauge', 'Readings waiting in the buffered ingest queue.', ingest_stats['queued']),
+        ('healink_ingest_commits_total', 'counter', 'Group commits by the buffered ingest writer.', ingest_stats['commits']),
+        ('healink_ingest_failed_rows_total', 'counter', 'Readings the buffered ingest writer failed to commit.', ingest_stats['failed_rows']),
+    ))
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+@admin_bp.route('/cache_stats')
+@roles_required('admin')
+def cache_stats():
+    return jsonify({
+        'clinical_context': clinical_cache.stats(),
+        'clinical_rules': rule_engine.stats(),
+        'associations': association_index.stats(),
+        'password_pool': password_pool.stats(),
+        'user_profiles': user_cache.stats(),
+        'logging': app_logging.stats(),
+        'vitals_stream': vitals_hub.stats(),
+        'sos': active_sos.stats(),
+        'ingest': ingest.buffer.stats()
+    })
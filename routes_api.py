@@ -1,130 +1,290 @@
 from flask import Blueprint, request, jsonify, Response, session, stream_with_context
-from db import get_db_connection, API_KEY
+from db import get_db, API_KEY
+from vitals import parse_reading, insert_readings, publish_readings, MAX_BATCH_SIZE
+from stream_hub import StreamHub
+from clinical import get_clinical_context
+from rules import rule_engine
+from associations import association_index
+from sos import active_sos, visible_alerts, sos_changed, publish_sos_changed
+from rollups import RESOLUTIONS, HISTORY_LIMIT, HISTORY_MAX_POINTS, parse_time, choose_resolution, read_history
+from pagination import encode_cursor, decode_cursor
+from export import EXPORT_FORMATS, export_chunks
+from datetime import datetime, timezone
+import ingest
 import json
-import time
+import math
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Longest a /api/sos_poll request is held open
+SOS_POLL_TIMEOUT = 25
+
 @api_bp.route('/update', methods=['POST'])
 def update_health_data():
-    data = request.json
+    data = request.get_json(silent=True) or {}
     api_key_header = request.headers.get('X-API-Key')
     
     if api_key_header != API_KEY and data.get('api_key') != API_KEY:
         return jsonify({'error': 'Unauthorized: Invalid API Key'}), 401
     
-    user_id = data.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Missing user_id'}), 400
+    try:
+        row = parse_reading(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not known_user_ids(get_db(), [row[0]]):
+        return jsonify({'error': 'Unknown user_id'}), 400
 
-    conn = get_db_connection()
+    if ingest.enabled():
+        try:
+            committed = ingest.submit([row])
+        except ingest.QueueFull:
+            response = jsonify({'error': 'Ingest queue full, retry later'})
+            response.headers['Retry-After'] = str(ingest.INGEST_RETRY_AFTER)
+            return response, 503
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        if ingest.INGEST_DURABILITY == 'enqueue':
+            return jsonify({'status': 'success', 'message': 'Data queued'})
+        if not committed:
+            return jsonify({'status': 'accepted', 'message': 'Data queued, commit pending'}), 202
+        return jsonify({'status': 'success', 'message': 'Data updated'})
+
+    conn = get_db()
     try:
-        conn.execute('''
-            INSERT INTO health_data (user_id, heart_rate, blood_pressure_sys, blood_pressure_dia, oxygen_level, temperature, sugar_level)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            data.get('heart_rate', 0),
-            data.get('blood_pressure_sys', 0),
-            data.get('blood_pressure_dia', 0),
-            data.get('oxygen_level', 0),
-            data.get('temperature', 0),
-            data.get('sugar_level', 0)
-        ))
+        insert_readings(conn, [row])
         conn.commit()
+        publish_readings([row])
         return jsonify({'status': 'success', 'message': 'Data updated'})
     except Exception as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def known_user_ids(conn, user_ids):
+    """The subset of user_ids that exist; readings for any other id are rejected."""
+    return {r['id'] for r in conn.execute(
+        f"SELECT id FROM users WHERE id IN ({','.join('?' * len(user_ids))})", list(user_ids))}
+
+def _parse_batch_body():
+    """Return (readings, envelope_api_key) from a JSON array, {"readings": [...]} or NDJSON body.
+
+    Undecodable NDJSON lines are kept as their error message so they get a per-item status.
+    """
+    raw = request.get_data(cache=False, as_text=True)
+    if request.mimetype not in ('application/x-ndjson', 'application/jsonl'):
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            body = None
+        if isinstance(body, list):
+            return body, None
+        if isinstance(body, dict):
+            readings = body.get('readings')
+            return (readings if isinstance(readings, list) else None), body.get('api_key')
+        if raw.lstrip().startswith('['):
+            return None, None
+
+    readings = []
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        try:
+            readings.append(json.loads(line))
+        except ValueError:
+            readings.append(ValueError('Malformed JSON line'))
+    return readings, None
+
+@api_bp.route('/update_batch', methods=['POST'])
+def update_health_data_batch():
+    readings, envelope_key = _parse_batch_body()
+    if readings is None:
+        return jsonify({'error': 'Body must be a JSON array, {"readings": [...]} or NDJSON'}), 400
+    if len(readings) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch too large (max {MAX_BATCH_SIZE} readings)'}), 413
+
+    # Gateways replaying single-reading payloads carry the key on every item
+    item_keys = readings and all(isinstance(r, dict) and r.get('api_key') == API_KEY for r in readings)
+    if request.headers.get('X-API-Key') != API_KEY and envelope_key != API_KEY and not item_keys:
+        return jsonify({'error': 'Unauthorized: Invalid API Key'}), 401
+    if not readings:
+        return jsonify({'error': 'Empty batch'}), 400
+
+    results = []
+    rows = []
+    for index, item in enumerate(readings):
+        try:
+            if isinstance(item, Exception):
+                raise item
+            row = parse_reading(item)
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'error': str(e)})
+            continue
+        results.append({'index': index, 'status': 'ok', 'user_id': row[0]})
+        rows.append(row)
+
+    conn = get_db()
+    try:
+        user_ids = sorted({row[0] for row in rows})
+        if user_ids:
+            known = known_user_ids(conn, user_ids)
+            if len(known) != len(user_ids):
+                rows = [row for row in rows if row[0] in known]
+                for result in results:
+                    if result['status'] == 'ok' and result['user_id'] not in known:
+                        result.update(status='error', error='Unknown user_id')
+        if rows:
+            insert_readings(conn, rows)
+            conn.commit()
+            publish_readings(rows)
+    except Exception as e:
+        conn.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+
+    accepted = len(rows)
+    rejected = len(results) - accepted
+    status = 'success' if not rejected else ('partial' if accepted else 'error')
+    return jsonify({
+        'status': status,
+        'accepted': accepted,
+        'rejected': rejected,
+        'results': results
+    }), (200 if accepted else 400)
 
 @api_bp.route('/history')
 def get_history():
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({'error': 'Missing user_id'}), 400
-    
-    conn = get_db_connection()
-    history = conn.execute('SELECT * FROM health_data WHERE user_id = ? ORDER BY timestamp DESC LIMIT 50', (user_id,)).fetchall()
-    conn.close()
-    
-    return jsonify([dict(row) for row in reversed(history)])
+
+    resolution = request.args.get('resolution', 'raw')
+    if resolution not in RESOLUTIONS:
+        return jsonify({'error': f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+    try:
+        start = parse_time(request.args['from']) if request.args.get('from') else None
+        end = parse_time(request.args['to']) if request.args.get('to') else None
+        before = decode_cursor(request.args['cursor'], 2) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = get_db()
+    if start is None and end is None:
+        # Without a range: the latest readings, or buckets, as before
+        if resolution == 'auto':
+            resolution = 'raw'
+        limit = HISTORY_LIMIT
+    else:
+        if resolution == 'auto':
+            start = start or '0001-01-01 00:00:00'
+            end = end or datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            resolution = choose_resolution(conn, user_id, start, end)
+        limit = HISTORY_MAX_POINTS
+
+    history, next_before = read_history(conn, user_id, resolution, start, end, limit, before)
+    response = jsonify(history)
+    response.headers['X-Resolution'] = resolution
+    if next_before:
+        # Older page: same parameters plus cursor (pass resolution explicitly when it was auto)
+        response.headers['X-Next-Cursor'] = encode_cursor(*next_before)
+    return response
 
 def get_clinical_alerts(user_id, vitals):
-    alerts = []
-    
-    # Standard Thresholds
-    hr = vitals.get('heart_rate', 0)
-    spo2 = vitals.get('oxygen_level', 0)
-    temp = vitals.get('temperature', 0)
-    sys = vitals.get('blood_pressure_sys', 0)
-    dia = vitals.get('blood_pressure_dia', 0)
-    sugar = vitals.get('sugar_level', 0)
-
-    if hr > 100: alerts.append({'type': 'danger', 'msg': 'High Heart Rate (Tachycardia)'})
-    if hr < 60 and hr > 0: alerts.append({'type': 'warning', 'msg': 'Low Heart Rate (Bradycardia)'})
-    if spo2 < 95 and spo2 > 0: alerts.append({'type': 'danger', 'msg': 'Low Oxygen Level (Hypoxia risk)'})
-    if temp > 38: alerts.append({'type': 'danger', 'msg': 'High Fever'})
-    if sys > 140 or dia > 90: alerts.append({'type': 'warning', 'msg': 'High Blood Pressure (Hypertension)'})
-
-    # Medication-aware checks
-    conn = get_db_connection()
-    clinical = conn.execute("SELECT medications FROM patient_clinical_info WHERE patient_id = ?", (user_id,)).fetchone()
-    conn.close()
-
-    if clinical and clinical['medications']:
-        meds = clinical['medications'].lower()
-        # Diabetes Check
-        if any(x in meds for x in ['insulin', 'metformin', 'glyburide']):
-            if sugar > 180: alerts.append({'type': 'danger', 'msg': 'Critically High Sugar (Diabetes Context)'})
-            elif sugar < 70 and sugar > 0: alerts.append({'type': 'danger', 'msg': 'Low Blood Sugar (Hypoglycemia risk)'})
-        
-        # Hypertension Meds Context
-        if any(x in meds for x in ['amlodipine', 'lisinopril', 'losartan']):
-            if sys > 130 or dia > 85: alerts.append({'type': 'warning', 'msg': 'Elevated BP despite hypertension meds'})
+    # Thresholds come from clinical_rules.json plus any per-patient overrides
+    return rule_engine.evaluate(user_id, vitals, get_clinical_context(user_id))
+
+def render_latest_vitals(user_id, last_id):
+    """Newest reading after last_id as a ready-to-send SSE event, computed once for all viewers."""
+    conn = get_db()
+    data = conn.execute('''
+        SELECT reading_id AS id, patient_id AS user_id, heart_rate, blood_pressure_sys, blood_pressure_dia,
+               oxygen_level, temperature, sugar_level, timestamp
+        FROM patient_latest WHERE patient_id = ? AND reading_id > ?
+    ''', (user_id, last_id)).fetchone()
+    if not data:
+        return None
+    vitals = dict(data)
+    vitals['alerts'] = get_clinical_alerts(user_id, vitals)
+    return data['id'], f"data: {json.dumps(vitals)}\n\n".encode()
 
-    return alerts
+vitals_hub = StreamHub('vitals', render_latest_vitals)
+
+def can_view_patient(viewer_id, role, patient_id):
+    if patient_id == viewer_id or role == 'admin':
+        return True
+    return association_index.is_monitor(viewer_id, patient_id)
 
 @api_bp.route('/stream')
 def stream_data():
     user_id = request.args.get('user_id') or session.get('user_id')
     if not user_id:
         return Response(status=401)
+    user_id = int(user_id)
 
     # Security check
-    if int(user_id) != session.get('user_id') and session.get('role') != 'admin':
-        conn = get_db_connection()
-        assoc = conn.execute('SELECT 1 FROM user_associations WHERE monitor_id = ? AND patient_id = ?', (session.get('user_id'), user_id)).fetchone()
-        conn.close()
-        if not assoc:
-            return Response(status=403)
+    if not can_view_patient(session.get('user_id'), session.get('role'), user_id):
+        return Response(status=403)
 
     def generate():
         last_id = 0
-        while True:
-            conn = get_db_connection()
-            try:
-                data = conn.execute('SELECT * FROM health_data WHERE id > ? AND user_id = ? ORDER BY id DESC LIMIT 1', (last_id, user_id)).fetchone()
-                if data:
-                    last_id = data['id']
-                    vitals = dict(data)
-                    vitals['alerts'] = get_clinical_alerts(user_id, vitals)
-                    yield f"data: {json.dumps(vitals)}\n\n"
-            finally:
-                conn.close()
-            time.sleep(1)
+        with vitals_hub.viewer(user_id) as ch:
+            while True:
+                latest = vitals_hub.wait(user_id, ch, last_id)
+                if latest is None:
+                    # Keep-alive; also how a closed EventSource gets noticed
+                    yield b": keepalive\n\n"
+                    continue
+                last_id, payload = latest
+                yield payload
 
     return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
+@api_bp.route('/export')
+def export_readings():
+    """Stream readings as CSV or NDJSON (optionally gzipped) for offline analysis.
+
+    ?patient_id=1,2 (omit for every patient, admins only), from/to, format=csv|ndjson,
+    gzip=1. Needs a session that may view every listed patient; scripts with database
+    access can use the export.py CLI instead.
+    """
+    try:
+        patient_ids = [int(p) for value in request.args.getlist('patient_id') for p in value.split(',') if p.strip()]
+    except ValueError:
+        return jsonify({'error': 'Invalid patient_id'}), 400
+
+    viewer_id = session.get('user_id')
+    if not viewer_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    role = session.get('role')
+    if not patient_ids and role != 'admin':
+        return jsonify({'error': 'Forbidden'}), 403
+    if not all(can_view_patient(viewer_id, role, pid) for pid in patient_ids):
+        return jsonify({'error': 'Forbidden'}), 403
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        start = parse_time(request.args['from']) if request.args.get('from') else None
+        end = parse_time(request.args['to']) if request.args.get('to') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    compress = request.args.get('gzip') in ('1', 'true')
+    filename = f"healink_export.{fmt}" + ('.gz' if compress else '')
+    return Response(
+        export_chunks(patient_ids, start, end, fmt, compress),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 @api_bp.route('/trigger_sos')
 def trigger_sos():
     patient_id = session.get('user_id')
     if not patient_id: return jsonify({'success': False}), 401
     
-    conn = get_db_connection()
+    conn = get_db()
     conn.execute('INSERT INTO sos_alerts (patient_id) VALUES (?)', (patient_id,))
+    sos_changed(conn)
     conn.commit()
-    conn.close()
+    publish_sos_changed(patient_id)
     return jsonify({'success': True})
 
 @api_bp.route('/meds_update')
@@ -132,10 +292,9 @@ def meds_update():
     med_id = request.args.get('id')
     if not med_id: return Response(status=400)
     
-    conn = get_db_connection()
+    conn = get_db()
     conn.execute('UPDATE medication_alerts SET taken = 1 WHERE id = ?', (med_id,))
     conn.commit()
-    conn.close()
     return jsonify({'status': 'success'})
 
 @api_bp.route('/save_note', methods=['POST'])
@@ -152,8 +311,57 @@ def check_sos():
     if not patient_id:
         return Response(status=400)
         
-    conn = get_db_connection()
-    alert = conn.execute("SELECT id FROM sos_alerts WHERE patient_id = ? AND status = 'active' LIMIT 1", (patient_id,)).fetchone()
-    conn.close()
-    
-    return jsonify({'active': bool(alert)})
+    try:
+        patient_id = int(patient_id)
+    except ValueError:
+        return Response(status=400)
+
+    return jsonify({'active': active_sos.is_active(patient_id)})
+
+def sos_alerts_for_viewer(alerts):
+    viewer_id = session.get('user_id')
+    role = session.get('role')
+    monitored = association_index.patients_of(viewer_id) if role != 'admin' else ()
+    return visible_alerts(alerts, viewer_id, role, monitored)
+
+@api_bp.route('/sos_stream')
+def sos_stream():
+    """SSE feed of the active SOS alerts the viewer may see; one event whenever that list changes."""
+    if 'user_id' not in session:
+        return Response(status=401)
+
+    def generate():
+        version = None
+        sent = None
+        while True:
+            latest = active_sos.wait(version)
+            if latest is None:
+                yield b": keepalive\n\n"
+                continue
+            version, alerts = latest
+            visible = sos_alerts_for_viewer(alerts)
+            if visible != sent:
+                sent = visible
+                yield f"data: {json.dumps({'version': version, 'active': visible})}\n\n".encode()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+@api_bp.route('/sos_poll')
+def sos_poll():
+    """Long-poll fallback for sos_stream: returns at once when ?version= is missing or
+    out of date, otherwise when the alerts change or after ?timeout= seconds.
+    """
+    if 'user_id' not in session:
+        return Response(status=401)
+    version = request.args.get('version', type=int)
+    timeout = request.args.get('timeout', SOS_POLL_TIMEOUT, type=float)
+    if not math.isfinite(timeout):
+        # nan slips through min/max and would make the wait endless
+        return jsonify({'error': 'Invalid timeout'}), 400
+    timeout = min(max(timeout, 0), SOS_POLL_TIMEOUT)
+
+    latest = active_sos.snapshot() if version is None else active_sos.wait(version, timeout)
+    if latest is None:
+        latest = active_sos.snapshot()
+    version, alerts = latest
+    return jsonify({'version': version, 'active': sos_alerts_for_viewer(alerts)})
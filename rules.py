@@ -0,0 +1,292 @@
+import bisect
+import json
+import os
+from collections import defaultdict
+from db import get_generation, bump_generation
+from reloadable import Reloadable
+from vitals import READING_FIELDS
+import clinical
+import notifier
+
+# Clinical alert thresholds live in clinical_rules.json; per-patient changes live in
+# clinical_rule_overrides. Both are compiled into a CompiledRules evaluator and
+# picked up by every worker without a restart: file edits within
+# RULES_RELOAD_INTERVAL seconds, override edits through the 'clinical_rules'
+# generation and the 'rules' channel (see reloadable.py).
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), 'clinical_rules.json')
+RULES_RELOAD_INTERVAL = 5
+RULES_GENERATION = 'clinical_rules'
+
+OPS = ('>', '>=', '<', '<=')
+ALERT_TYPES = ('danger', 'warning', 'info')
+
+
+class RuleError(ValueError):
+    pass
+
+
+def rule_conditions(rule, key):
+    conditions = rule.get(key, [])
+    if not isinstance(conditions, list):
+        raise RuleError(f"Rule {rule.get('id')}: '{key}' must be a list")
+    parsed = []
+    for condition in conditions:
+        if not isinstance(condition, (list, tuple)) or len(condition) != 3:
+            raise RuleError(f"Rule {rule.get('id')}: conditions are [field, op, value]")
+        field, op, value = condition
+        if field not in READING_FIELDS:
+            raise RuleError(f"Rule {rule.get('id')}: unknown field {field!r}")
+        if op not in OPS:
+            raise RuleError(f"Rule {rule.get('id')}: unknown operator {op!r}")
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise RuleError(f"Rule {rule.get('id')}: threshold must be a number")
+        parsed.append((field, op, value))
+    return parsed
+
+
+def validate_rule(rule, contexts=None):
+    """contexts: the known 'when' flags (default: clinical.CONTEXT_MEDICATIONS)."""
+    if not isinstance(rule, dict) or not rule.get('id'):
+        raise RuleError('Each rule needs an id')
+    if rule.get('type') not in ALERT_TYPES:
+        raise RuleError(f"Rule {rule['id']}: type must be one of {', '.join(ALERT_TYPES)}")
+    if not rule.get('msg'):
+        raise RuleError(f"Rule {rule['id']}: missing msg")
+    if contexts is None:
+        contexts = clinical.CONTEXT_MEDICATIONS
+    if rule.get('when') and rule['when'] not in contexts:
+        raise RuleError(f"Rule {rule['id']}: unknown context {rule['when']!r}, expected one of {', '.join(contexts)}")
+    all_conditions = rule_conditions(rule, 'all')
+    any_conditions = rule_conditions(rule, 'any')
+    if not all_conditions and not any_conditions:
+        raise RuleError(f"Rule {rule['id']}: needs 'all' or 'any' conditions")
+    return rule
+
+
+def _number(value):
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class CompiledRules:
+    """Flat evaluator for one rule set.
+
+    Every distinct (field, op, threshold) predicate and every context flag gets a
+    bit. Per field and operator the thresholds are kept sorted with cumulative bit
+    masks, so a reading is turned into its "satisfied predicates" mask with one
+    bisect per field/operator. Rules are then only checked when one of their
+    trigger bits is set, which keeps the cost proportional to what actually fires
+    rather than to the number of rules.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        bits = {}
+
+        def bit(key):
+            return 1 << bits.setdefault(key, len(bits))
+
+        predicates = defaultdict(lambda: defaultdict(dict))
+        self._compiled = []
+        self._by_bit = defaultdict(list)
+        self._context_bits = {}
+        for index, rule in enumerate(rules):
+            required = 0
+            any_mask = 0
+            for field, op, value in rule_conditions(rule, 'all'):
+                b = bit(('p', field, op, value))
+                predicates[field][op][value] = b
+                required |= b
+            for field, op, value in rule_conditions(rule, 'any'):
+                b = bit(('p', field, op, value))
+                predicates[field][op][value] = b
+                any_mask |= b
+            triggers = [any_mask] if any_mask else [required & -required]
+            if rule.get('when'):
+                b = self._context_bits.setdefault(rule['when'], bit(('c', rule['when'])))
+                required |= b
+            alert = {'type': rule['type'], 'msg': rule['msg'], 'rule': rule['id']}
+            self._compiled.append((required, any_mask, alert))
+            for mask in triggers:
+                while mask:
+                    low = mask & -mask
+                    mask ^= low
+                    self._by_bit[low].append(index)
+
+        self._fields = []
+        for field, ops in predicates.items():
+            compiled_ops = []
+            for op, by_value in ops.items():
+                thresholds = sorted(by_value)
+                masks = [by_value[t] for t in thresholds]
+                if op in ('>', '>='):
+                    # prefix[k] = bits of the k smallest thresholds
+                    cumulative = [0]
+                    for m in masks:
+                        cumulative.append(cumulative[-1] | m)
+                else:
+                    # suffix[k] = bits of thresholds[k:]
+                    cumulative = [0] * (len(masks) + 1)
+                    for k in range(len(masks) - 1, -1, -1):
+                        cumulative[k] = cumulative[k + 1] | masks[k]
+                search = bisect.bisect_right if op in ('>=', '<') else bisect.bisect_left
+                compiled_ops.append((search, thresholds, cumulative))
+            self._fields.append((field, compiled_ops))
+
+    def _mask(self, reading, context):
+        mask = 0
+        for field, ops in self._fields:
+            value = _number(reading.get(field) or 0)
+            for search, thresholds, cumulative in ops:
+                mask |= cumulative[search(thresholds, value)]
+        for flag in context:
+            mask |= self._context_bits.get(flag, 0)
+        return mask
+
+    def evaluate(self, reading, context=clinical.NO_CONTEXT):
+        mask = self._mask(reading, context)
+        fired = set()
+        pending = mask
+        while pending:
+            low = pending & -pending
+            pending ^= low
+            for index in self._by_bit.get(low, ()):
+                required, any_mask, _ = self._compiled[index]
+                if mask & required == required and (not any_mask or mask & any_mask):
+                    fired.add(index)
+        return [dict(self._compiled[index][2]) for index in sorted(fired)]
+
+    def evaluate_many(self, readings, context=clinical.NO_CONTEXT):
+        return [self.evaluate(reading, context) for reading in readings]
+
+
+def merge_overrides(base_rules, overrides):
+    """Apply (rule_id, enabled, params) overrides to the base rule list.
+
+    An override replaces any keys of the base rule it names, disables it when
+    enabled is 0, or adds a new patient-only rule when the id is not in the base.
+    """
+    rules = {rule['id']: rule for rule in base_rules}
+    order = [rule['id'] for rule in base_rules]
+    for rule_id, enabled, params in overrides:
+        if not enabled:
+            rules.pop(rule_id, None)
+            continue
+        merged = dict(rules.get(rule_id, {}))
+        merged.update(params)
+        merged['id'] = rule_id
+        validate_rule(merged)
+        if rule_id not in rules:
+            order.append(rule_id)
+        rules[rule_id] = merged
+    return [rules[rule_id] for rule_id in order if rule_id in rules]
+
+
+class RuleEngine(Reloadable):
+    GENERATION = RULES_GENERATION
+    RELOAD_INTERVAL = RULES_RELOAD_INTERVAL
+
+    def __init__(self, path=RULES_PATH):
+        super().__init__()
+        self.path = path
+        self._base = None
+        self._overrides = {}
+        self._compiled = {}
+        self.definitions = []
+        self.reloads = 0
+        self.last_error = None
+
+    def _current_version(self, conn):
+        return os.stat(self.path).st_mtime_ns, get_generation(conn, RULES_GENERATION)
+
+    def _load(self, conn, version):
+        try:
+            with open(self.path) as f:
+                config = json.load(f)
+            contexts = {flag: tuple(keywords) for flag, keywords in config.get('contexts', {}).items()}
+            definitions = [validate_rule(rule, contexts or clinical.CONTEXT_MEDICATIONS) for rule in config.get('rules', [])]
+            base = CompiledRules(definitions)
+        except (OSError, ValueError) as e:
+            # Keep serving the last good rule set; refuse to start without one
+            self.last_error = str(e)
+            if self._base is None:
+                raise
+            return
+
+        overrides = defaultdict(list)
+        for row in conn.execute("SELECT patient_id, rule_id, enabled, params FROM clinical_rule_overrides ORDER BY id"):
+            overrides[str(row['patient_id'])].append((row['rule_id'], row['enabled'], json.loads(row['params'] or '{}')))
+
+        if contexts and contexts != clinical.CONTEXT_MEDICATIONS:
+            clinical.CONTEXT_MEDICATIONS = contexts
+            clinical.clinical_cache.invalidate()
+
+        self.definitions = definitions
+        self._base = base
+        self._overrides = dict(overrides)
+        self._compiled = {}
+        self._version = version
+        self.reloads += 1
+        self.last_error = None
+
+    def base_rules(self):
+        """The rule definitions of clinical_rules.json, without overrides."""
+        self._ensure_fresh()
+        return self.definitions
+
+    def rules_for(self, patient_id):
+        self._ensure_fresh()
+        key = str(patient_id)
+        overrides = self._overrides.get(key)
+        if not overrides:
+            return self._base
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            try:
+                compiled = CompiledRules(merge_overrides(self.definitions, overrides))
+            except RuleError as e:
+                self.last_error = f"Patient {key}: {e}"
+                compiled = self._base
+            self._compiled[key] = compiled
+        return compiled
+
+    def evaluate(self, patient_id, reading, context=clinical.NO_CONTEXT):
+        return self.rules_for(patient_id).evaluate(reading, context)
+
+    def evaluate_many(self, patient_id, readings, context=clinical.NO_CONTEXT):
+        return self.rules_for(patient_id).evaluate_many(readings, context)
+
+    def stats(self):
+        return {
+            'rules': len(self.definitions),
+            'patients_with_overrides': len(self._overrides),
+            'reloads': self.reloads,
+            'last_error': self.last_error
+        }
+
+
+def validate_override(rule_id, enabled, params):
+    """Raise RuleError unless the override would compile against the current base rules."""
+    if not rule_id:
+        raise RuleError('Missing rule id')
+    if not isinstance(params, dict):
+        raise RuleError('Override must be a JSON object')
+    CompiledRules(merge_overrides(rule_engine.base_rules(), [(rule_id, enabled, params)]))
+
+
+rule_engine = RuleEngine()
+notifier.subscribe('rules', rule_engine.mark_stale)
+
+
+def rules_changed(conn):
+    """Record an override change; call publish_rules_changed() after committing."""
+    bump_generation(conn, RULES_GENERATION)
+
+
+def publish_rules_changed():
+    notifier.publish('rules', '*')
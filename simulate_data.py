@@ -1,12 +1,17 @@
-import requests
-import time
+import argparse
+import asyncio
+import heapq
+import json
 import random
 import sys
+import time
+import urllib.parse
 
 API_URL = "http://localhost:5000/api/update"
 API_KEY = "HEALINK_v1_KEY"
 
 def simulate(user_id):
+    import requests
     print(f"Starting simulation for User {user_id}...")
     while True:
         data = {
@@ -19,7 +24,7 @@ def simulate(user_id):
             "temperature": round(random.uniform(36.5, 37.5), 1),
             "sugar_level": round(random.uniform(80, 120), 1)
         }
-        
+
         try:
             response = requests.post(API_URL, json=data)
             if response.status_code == 200:
@@ -28,9 +33,281 @@ def simulate(user_id):
                 print(f"Error: {response.status_code} - {response.text}")
         except Exception as e:
             print(f"Connection error: {e}")
-            
+
         time.sleep(5)
 
+
+# Fleet mode: many simulated devices from one process, for capacity planning of
+# the ingest path. Each device's readings come from its own seeded RNG, so a
+# schedule is fully determined by --seed and the options; --record saves it as
+# NDJSON and --replay sends a recorded one again. Requests share a fixed pool of
+# keep-alive connections (plain asyncio, no extra dependencies).
+#
+#   python simulate_data.py --fleet --devices 20000 --rate 2 --duration 300 --connections 64
+#   python simulate_data.py --fleet --devices 5000 --batch 200 --abnormal 0.02 --record trace.ndjson
+#   python simulate_data.py --fleet --replay trace.ndjson --speed 4
+
+ABNORMAL_VITALS = (
+    {'heart_rate': (125, 170)},
+    {'heart_rate': (35, 50)},
+    {'oxygen_level': (82, 92)},
+    {'temperature': (38.5, 40.5)},
+    {'blood_pressure_sys': (150, 190), 'blood_pressure_dia': (95, 120)},
+)
+
+
+def reading_for(rng, user_id, abnormal_rate):
+    reading = {
+        "user_id": user_id,
+        "heart_rate": rng.randint(60, 100),
+        "blood_pressure_sys": rng.randint(110, 140),
+        "blood_pressure_dia": rng.randint(70, 90),
+        "oxygen_level": rng.randint(95, 100),
+        "temperature": round(rng.uniform(36.5, 37.5), 1),
+        "sugar_level": round(rng.uniform(80, 120), 1)
+    }
+    if rng.random() < abnormal_rate:
+        for field, (low, high) in rng.choice(ABNORMAL_VITALS).items():
+            reading[field] = round(rng.uniform(low, high), 1) if isinstance(low, float) else rng.randint(low, high)
+    return reading
+
+
+def device_schedule(device, user_id, args):
+    """Yield (offset_seconds, reading) for one device over args.duration seconds.
+
+    Arrivals are Poisson at args.rate readings/minute, multiplied by args.burst_factor
+    during the first args.burst_length seconds of every args.burst_every. An outage
+    (probability args.outage_prob per reading) silences the device for
+    args.outage_length seconds; what it measured meanwhile is sent when it comes back.
+    """
+    rng = random.Random(f"{args.seed}:{device}")
+    t = rng.uniform(0, 60 / args.rate)
+    backlog = []
+    down_until = None
+    while t < args.duration:
+        bursting = args.burst_every and t % args.burst_every < args.burst_length
+        rate = args.rate * (args.burst_factor if bursting else 1)
+        reading = reading_for(rng, user_id, args.abnormal)
+        if down_until is None and rng.random() < args.outage_prob:
+            down_until = t + args.outage_length
+        if down_until is not None:
+            backlog.append(reading)
+            if t >= down_until:
+                for queued in backlog:
+                    yield t, queued
+                backlog = []
+                down_until = None
+        else:
+            yield t, reading
+        t += rng.expovariate(rate / 60)
+
+
+def fleet_schedule(args):
+    user_ids = parse_user_ids(args.users)
+    streams = [device_schedule(device, user_ids[device % len(user_ids)], args) for device in range(args.devices)]
+    return heapq.merge(*streams, key=lambda event: event[0])
+
+
+def replay_schedule(path, speed):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                yield event['t'] / speed, event['reading']
+
+
+def parse_user_ids(spec):
+    """'2-1001,2000' -> [2, 3, ..., 1001, 2000]"""
+    user_ids = []
+    for part in spec.split(','):
+        if '-' in part:
+            low, high = part.split('-', 1)
+            user_ids.extend(range(int(low), int(high) + 1))
+        elif part.strip():
+            user_ids.append(int(part))
+    if not user_ids:
+        raise ValueError('No user ids given')
+    return user_ids
+
+
+class KeepAliveConnection:
+    """One persistent HTTP/1.1 connection; reconnects after errors or a server close."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def post_json(self, path, body, timeout):
+        payload = json.dumps(body).encode()
+        request = (f"POST {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                   f"X-API-Key: {API_KEY}\r\nContent-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n").encode() + payload
+        for attempt in (1, 2):
+            try:
+                if self.writer is None:
+                    self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+                self.writer.write(request)
+                return await asyncio.wait_for(self._read_response(), timeout)
+            except (OSError, asyncio.IncompleteReadError, ValueError, asyncio.TimeoutError):
+                self.close()
+                if attempt == 2:
+                    raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        status = int(status_line.split()[1])
+        length = 0
+        keep_alive = True
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                keep_alive = False
+        body = await self.reader.readexactly(length) if length else b''
+        if not keep_alive:
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class FleetStats:
+    def __init__(self):
+        self.requests = 0
+        self.readings = 0
+        self.statuses = {}
+        self.errors = 0
+        self.latencies_ms = []
+        self.behind_ms = 0.0
+
+    def summary(self, elapsed):
+        values = sorted(self.latencies_ms)
+
+        def pick(pct):
+            return round(values[min(len(values) - 1, int(pct / 100 * len(values)))], 1) if values else None
+
+        return {
+            'elapsed_s': round(elapsed, 1),
+            'requests': self.requests,
+            'readings': self.readings,
+            'readings_per_s': round(self.readings / elapsed, 1) if elapsed else None,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items())},
+            'connection_errors': self.errors,
+            'latency_ms_p50': pick(50),
+            'latency_ms_p95': pick(95),
+            'latency_ms_p99': pick(99),
+            'max_schedule_lag_ms': round(self.behind_ms, 1),
+        }
+
+
+async def run_fleet(args):
+    parsed = urllib.parse.urlparse(args.url)
+    host, port = parsed.hostname, parsed.port or 80
+    single_path = parsed.path or '/api/update'
+    batch_path = single_path.rsplit('/', 1)[0] + '/update_batch'
+    schedule = replay_schedule(args.replay, args.speed) if args.replay else fleet_schedule(args)
+    trace = open(args.record, 'w') if args.record else None
+
+    stats = FleetStats()
+    queue = asyncio.Queue(maxsize=args.connections * 4)
+
+    async def sender():
+        conn = KeepAliveConnection(host, port)
+        while True:
+            item = await queue.get()
+            if item is None:
+                conn.close()
+                return
+            path, body, count = item
+            started = time.perf_counter()
+            try:
+                status, _ = await conn.post_json(path, body, args.timeout)
+                stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            except (OSError, asyncio.IncompleteReadError, ValueError, asyncio.TimeoutError):
+                stats.errors += 1
+            stats.latencies_ms.append((time.perf_counter() - started) * 1000)
+            stats.requests += 1
+            stats.readings += count
+
+    senders = [asyncio.ensure_future(sender()) for _ in range(args.connections)]
+    batch = []
+    batch_started = None
+    started = time.perf_counter()
+
+    async def flush():
+        nonlocal batch, batch_started
+        if batch:
+            await queue.put((batch_path, {'readings': batch}, len(batch)))
+        batch = []
+        batch_started = None
+
+    for offset, reading in schedule:
+        if trace:
+            trace.write(json.dumps({'t': round(offset, 4), 'reading': reading}) + '\n')
+        delay = offset - (time.perf_counter() - started)
+        if delay > 0:
+            if batch and batch_started is not None and delay > args.batch_window - (time.perf_counter() - batch_started):
+                await flush()
+            await asyncio.sleep(delay)
+        else:
+            stats.behind_ms = max(stats.behind_ms, -delay * 1000)
+        if args.batch > 1:
+            batch.append(reading)
+            batch_started = batch_started or time.perf_counter()
+            if len(batch) >= args.batch:
+                await flush()
+        else:
+            await queue.put((single_path, reading, 1))
+    await flush()
+    for _ in senders:
+        await queue.put(None)
+    await asyncio.gather(*senders)
+    if trace:
+        trace.close()
+    return stats.summary(time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Send simulated vitals to /api/update.')
+    parser.add_argument('user_id', nargs='?', default=2, help='single-device mode: the patient to simulate')
+    parser.add_argument('--fleet', action='store_true', help='simulate many devices (options below)')
+    parser.add_argument('--url', default=API_URL)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--users', default='2', help="patient ids the devices report for, e.g. '2-1001' (round robin)")
+    parser.add_argument('--rate', type=float, default=12, help='readings per device per minute')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of schedule to generate')
+    parser.add_argument('--burst-every', type=float, default=0, help='seconds between bursts (0: no bursts)')
+    parser.add_argument('--burst-length', type=float, default=10)
+    parser.add_argument('--burst-factor', type=float, default=5)
+    parser.add_argument('--outage-prob', type=float, default=0, help='chance per reading that a device drops out')
+    parser.add_argument('--outage-length', type=float, default=30, help='seconds; the backlog is sent on return')
+    parser.add_argument('--abnormal', type=float, default=0, help='fraction of readings with out-of-range vitals')
+    parser.add_argument('--batch', type=int, default=1, help='send via /api/update_batch in groups of up to N')
+    parser.add_argument('--batch-window', type=float, default=0.5, help='seconds a partial batch may wait')
+    parser.add_argument('--connections', type=int, default=32, help='keep-alive connections to the server')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', default='healink')
+    parser.add_argument('--record', help='write the generated schedule as NDJSON')
+    parser.add_argument('--replay', help='send a schedule recorded with --record instead of generating one')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed multiplier')
+    args = parser.parse_args(argv)
+
+    if not args.fleet:
+        simulate(args.user_id)
+        return
+    print(json.dumps(asyncio.run(run_fleet(args)), indent=2))
+
+
 if __name__ == '__main__':
-    uid = sys.argv[1] if len(sys.argv) > 1 else 2
-    simulate(uid)
+    main(sys.argv[1:])
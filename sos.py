@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from contextlib import nullcontext
+from db import bump_generation
+from reloadable import Reloadable
+from stream_hub import STREAM_RECHECK_INTERVAL
+import notifier
+
+# In-memory set of active SOS alerts, shared by /api/check_sos, the SOS
+# stream/long-poll endpoints and the admin console. Triggering or dismissing an
+# alert bumps the 'sos_alerts' generation and publishes on the 'sos' channel,
+# which wakes every waiting viewer in every worker; the set is reloaded once per
+# change per process (see reloadable.py), and waiting viewers cost no queries.
+
+SOS_RELOAD_INTERVAL = 5
+SOS_GENERATION = 'sos_alerts'
+
+
+class ActiveSOS(Reloadable):
+    GENERATION = SOS_GENERATION
+    RELOAD_INTERVAL = SOS_RELOAD_INTERVAL
+
+    def __init__(self):
+        super().__init__()
+        self._cond = threading.Condition()
+        self._wakeups = 0
+        self._async_waiters = set()
+        # Newest first; each alert is a dict with id, patient_id, full_name, timestamp
+        self._alerts = ()
+        self._patients = frozenset()
+        # Context snapshot() needs when run off a request thread (set by asgi.py)
+        self.loader_context = nullcontext
+        self.reloads = 0
+
+    def mark_stale(self, key=None):
+        super().mark_stale(key)
+        with self._cond:
+            self._wakeups += 1
+            self._cond.notify_all()
+            for loop, event in list(self._async_waiters):
+                loop.call_soon_threadsafe(event.set)
+
+    def _load(self, conn, generation):
+        alerts = tuple(dict(row) for row in conn.execute("""
+            SELECT s.id, s.patient_id, u.full_name, s.timestamp
+            FROM sos_alerts s JOIN users u ON s.patient_id = u.id
+            WHERE s.status = 'active' ORDER BY s.timestamp DESC, s.id DESC
+        """))
+        self._alerts = alerts
+        self._patients = frozenset(alert['patient_id'] for alert in alerts)
+        self._version = generation
+        self.reloads += 1
+
+    def snapshot(self):
+        """(version, alerts): version is the 'sos_alerts' generation, the same in every worker."""
+        self._ensure_fresh()
+        return self._version, self._alerts
+
+    def is_active(self, patient_id):
+        self._ensure_fresh()
+        return patient_id in self._patients
+
+    def wait(self, version, timeout=STREAM_RECHECK_INTERVAL):
+        """Block until the version differs from `version`; returns (version, alerts) or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                seen = self._wakeups
+            current = self.snapshot()
+            if current[0] != version:
+                return current
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            with self._cond:
+                if self._wakeups == seen:
+                    self._cond.wait(remaining)
+
+    def _snapshot_in_context(self):
+        with self.loader_context():
+            return self.snapshot()
+
+    async def wait_async(self, version, timeout=STREAM_RECHECK_INTERVAL):
+        """asyncio counterpart of wait(); reloads run in the default executor."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            event = asyncio.Event()
+            waiter = (loop, event)
+            with self._cond:
+                self._async_waiters.add(waiter)
+            try:
+                current = await loop.run_in_executor(None, self._snapshot_in_context)
+                if current[0] != version:
+                    return current
+                try:
+                    await asyncio.wait_for(event.wait(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    return None
+            finally:
+                with self._cond:
+                    self._async_waiters.discard(waiter)
+
+    def stats(self):
+        return {
+            'active': len(self._alerts),
+            'generation': self._version,
+            'reloads': self.reloads
+        }
+
+
+active_sos = ActiveSOS()
+notifier.subscribe('sos', active_sos.mark_stale)
+
+
+def visible_alerts(alerts, viewer_id, role, monitored):
+    """The alerts a viewer may see: all for admins, otherwise their own and their patients'."""
+    if role == 'admin':
+        return list(alerts)
+    return [alert for alert in alerts if alert['patient_id'] == viewer_id or alert['patient_id'] in monitored]
+
+
+def sos_changed(conn):
+    """Record an sos_alerts change; call publish_sos_changed() after committing."""
+    bump_generation(conn, SOS_GENERATION)
+
+
+def publish_sos_changed(patient_id='*'):
+    notifier.publish('sos', patient_id)
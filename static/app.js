@@ -1,5 +1,8 @@
 document.addEventListener('DOMContentLoaded', () => {
     const ctx = document.getElementById('healthChart');
+    const rangeSelect = document.getElementById('history-range');
+    // health_data timestamps are UTC 'YYYY-MM-DD HH:MM:SS'
+    const parseTime = ts => new Date(ts.replace(' ', 'T') + 'Z');
     let healthChart;
 
     if (ctx) {
@@ -33,25 +36,47 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         });
 
-        // Load History
-        if (window.history_api_url && window.current_user_id) {
-            fetch(`${window.history_api_url}?user_id=${window.current_user_id}`)
+        // Load History: the latest raw readings for the live view, rollup buckets for longer ranges
+        const HISTORY_RANGES = { '24h': 1, '7d': 7, '30d': 30, '365d': 365 };
+        const toSqlTime = d => d.toISOString().slice(0, 19).replace('T', ' ');
+
+        function loadHistory(range) {
+            let url = `${window.history_api_url}?user_id=${window.current_user_id}`;
+            if (range) {
+                const to = new Date();
+                const from = new Date(to.getTime() - HISTORY_RANGES[range] * 86400000);
+                url += `&resolution=auto&from=${encodeURIComponent(toSqlTime(from))}&to=${encodeURIComponent(toSqlTime(to))}`;
+            }
+            fetch(url)
                 .then(r => r.json())
                 .then(data => {
+                    const longRange = range && HISTORY_RANGES[range] > 1;
+                    healthChart.data.labels = [];
+                    healthChart.data.datasets.forEach(dataset => dataset.data = []);
                     data.forEach(point => {
-                        const time = new Date(point.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+                        const when = parseTime(point.timestamp);
+                        const time = longRange
+                            ? when.toLocaleDateString([], { month: 'short', day: 'numeric' })
+                            : when.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
                         healthChart.data.labels.push(time);
                         healthChart.data.datasets[0].data.push(point.heart_rate);
                         healthChart.data.datasets[1].data.push(point.sugar_level);
                     });
                     healthChart.update();
 
-                    if (data.length > 0) {
+                    if (!range && data.length > 0) {
                         const latest = data[data.length - 1];
                         updateUI(latest);
                     }
                 });
         }
+
+        if (window.history_api_url && window.current_user_id) {
+            loadHistory('');
+            if (rangeSelect) {
+                rangeSelect.addEventListener('change', () => loadHistory(rangeSelect.value));
+            }
+        }
     }
 
     // SSE Connection
@@ -63,8 +88,9 @@ document.addEventListener('DOMContentLoaded', () => {
             const data = JSON.parse(event.data);
             updateUI(data);
 
-            if (healthChart) {
-                const time = new Date(data.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+            // Live points only go on the chart in the live view, not over a long-range history
+            if (healthChart && !(rangeSelect && rangeSelect.value)) {
+                const time = parseTime(data.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
                 healthChart.data.labels.push(time);
                 healthChart.data.datasets[0].data.push(data.heart_rate);
                 healthChart.data.datasets[1].data.push(data.sugar_level);
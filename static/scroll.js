@@ -0,0 +1,35 @@
+// Infinite scroll for server-rendered lists. A container with data-scroll-url and
+// data-next-cursor gets the next page (an HTML fragment) appended when its end
+// scrolls into view; the server returns the following cursor in X-Next-Cursor.
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('[data-scroll-url]').forEach(list => {
+        const sentinel = document.createElement('div');
+        (list.closest('table') || list).after(sentinel);
+        let loading = false;
+
+        const observer = new IntersectionObserver(entries => {
+            if (!entries[0].isIntersecting || loading || !list.dataset.nextCursor) return;
+            loading = true;
+            const url = new URL(list.dataset.scrollUrl, window.location.href);
+            url.searchParams.set('cursor', list.dataset.nextCursor);
+            fetch(url)
+                .then(r => {
+                    if (!r.ok) throw new Error(`HTTP ${r.status}`);
+                    list.dataset.nextCursor = r.headers.get('X-Next-Cursor') || '';
+                    return r.text();
+                })
+                .then(html => list.insertAdjacentHTML('beforeend', html))
+                .catch(err => {
+                    console.error('Loading more failed', err);
+                    list.dataset.nextCursor = '';
+                })
+                .finally(() => {
+                    loading = false;
+                    // Re-arm so a sentinel that is still visible loads the next page too
+                    observer.unobserve(sentinel);
+                    observer.observe(sentinel);
+                });
+        });
+        observer.observe(sentinel);
+    });
+});
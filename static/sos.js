@@ -0,0 +1,53 @@
+// Live SOS alerts. An element with data-sos-stream-url is shown while any alert
+// the viewer may see is active; its [data-sos-list] child is re-rendered from
+// each event. With data-dismiss-url (admin console) every alert gets a Dismiss button.
+document.addEventListener('DOMContentLoaded', () => {
+    const panel = document.querySelector('[data-sos-stream-url]');
+    if (!panel) return;
+    const list = panel.querySelector('[data-sos-list]') || panel;
+    const dismissUrl = panel.dataset.dismissUrl;
+
+    function render(alerts) {
+        list.innerHTML = '';
+        alerts.forEach(alert => {
+            const item = document.createElement('div');
+            item.className = 'sos-item';
+            item.style.cssText = `
+                background: rgba(239, 68, 68, 0.1);
+                border: 1px solid rgba(239, 68, 68, 0.2);
+                padding: 1rem;
+                border-radius: 15px;
+                margin-bottom: 1rem;
+                display: flex;
+                justify-content: space-between;
+                align-items: center;
+            `;
+            const who = document.createElement('div');
+            const name = document.createElement('strong');
+            name.textContent = alert.full_name;
+            const when = document.createElement('div');
+            when.style.cssText = 'font-size: 0.8rem; color: var(--text-secondary);';
+            when.textContent = alert.timestamp;
+            who.append(name, when);
+            item.append(who);
+
+            if (dismissUrl) {
+                const form = document.createElement('form');
+                form.action = dismissUrl;
+                form.method = 'POST';
+                form.innerHTML = `
+                    <input type="hidden" name="action" value="dismiss_sos">
+                    <input type="hidden" name="sos_id" value="${Number(alert.id)}">
+                    <button type="submit" class="btn-submit" style="background: #ef4444; font-size: 0.8rem;">Dismiss Alert</button>
+                `;
+                item.append(form);
+            }
+            list.append(item);
+        });
+        panel.style.display = alerts.length ? '' : 'none';
+    }
+
+    // EventSource reconnects on its own after a dropped connection
+    const eventSource = new EventSource(panel.dataset.sosStreamUrl);
+    eventSource.onmessage = event => render(JSON.parse(event.data).active);
+});
@@ -0,0 +1,94 @@
+// Server-side user search for the admin console, instead of rendering every
+// user into the page.
+// - [data-typeahead-url]: a text input plus a hidden id input; typing queries
+//   the search API (narrowed to data-roles) and picking a result fills the id.
+// - [data-user-filter]: a search box that reloads the rows of the table body
+//   named by its value (a selector), keeping infinite scroll working on the results.
+document.addEventListener('DOMContentLoaded', () => {
+    const debounce = (fn, ms) => {
+        let timer;
+        return (...args) => {
+            clearTimeout(timer);
+            timer = setTimeout(() => fn(...args), ms);
+        };
+    };
+
+    document.querySelectorAll('[data-typeahead-url]').forEach(box => {
+        const input = box.querySelector('input[type="text"]');
+        const hidden = box.querySelector('input[type="hidden"]');
+        const menu = document.createElement('div');
+        menu.style.cssText = `
+            display: none; position: absolute; left: 0; right: 0; z-index: 10; max-height: 240px; overflow-y: auto;
+            background: #1e293b; border: 1px solid var(--glass-border); border-radius: 8px; margin-top: 2px;
+        `;
+        box.style.position = 'relative';
+        box.append(menu);
+        let latest = 0;
+
+        const choose = user => {
+            hidden.value = user.id;
+            input.value = user.full_name;
+            input.setCustomValidity('');
+            menu.style.display = 'none';
+        };
+
+        const search = debounce(() => {
+            const url = new URL(box.dataset.typeaheadUrl, window.location.href);
+            url.searchParams.set('q', input.value);
+            if (box.dataset.roles) url.searchParams.set('role', box.dataset.roles);
+            const request = ++latest;
+            fetch(url)
+                .then(r => r.json())
+                .then(users => {
+                    // Answers can arrive out of order; only the newest query's counts
+                    if (request !== latest) return;
+                    menu.innerHTML = '';
+                    users.forEach(user => {
+                        const option = document.createElement('div');
+                        option.style.cssText = 'padding: 0.5rem 0.75rem; cursor: pointer; font-size: 0.85rem;';
+                        option.textContent = `${user.full_name} (${user.username}, ${user.role.replace(/_/g, ' ')})`;
+                        option.addEventListener('mousedown', event => {
+                            event.preventDefault();
+                            choose(user);
+                        });
+                        menu.append(option);
+                    });
+                    menu.style.display = users.length ? 'block' : 'none';
+                })
+                .catch(err => console.error('User search failed', err));
+        }, 150);
+
+        input.addEventListener('input', () => {
+            hidden.value = '';
+            input.setCustomValidity('Pick a user from the list');
+            search();
+        });
+        input.addEventListener('focus', search);
+        input.addEventListener('blur', () => menu.style.display = 'none');
+        input.setCustomValidity(hidden.value ? '' : 'Pick a user from the list');
+    });
+
+    document.querySelectorAll('[data-user-filter]').forEach(filter => {
+        const rows = document.querySelector(filter.dataset.userFilter);
+        const baseUrl = rows.dataset.scrollUrl;
+        let latest = 0;
+
+        filter.addEventListener('input', debounce(() => {
+            const url = new URL(baseUrl, window.location.href);
+            if (filter.value.trim()) url.searchParams.set('q', filter.value);
+            const request = ++latest;
+            fetch(url)
+                .then(r => {
+                    if (!r.ok) throw new Error(`HTTP ${r.status}`);
+                    return r.text().then(html => [html, r.headers.get('X-Next-Cursor') || '']);
+                })
+                .then(([html, cursor]) => {
+                    if (request !== latest) return;
+                    rows.innerHTML = html;
+                    rows.dataset.scrollUrl = url.pathname + url.search;
+                    rows.dataset.nextCursor = cursor;
+                })
+                .catch(err => console.error('User filter failed', err));
+        }, 200));
+    });
+});
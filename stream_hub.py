@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+import notifier
+
+# Seconds a viewer waits for a notification before re-checking the database anyway.
+# Also used as the SSE keep-alive interval.
+STREAM_RECHECK_INTERVAL = 15
+
+
+class _Channel:
+    __slots__ = ('cond', 'viewers', 'dirty', 'refreshing', 'checked_at', 'latest_id', 'payload', 'async_waiters')
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.viewers = 0
+        self.dirty = True
+        self.refreshing = False
+        self.checked_at = 0.0
+        self.latest_id = 0
+        self.payload = None
+        self.async_waiters = set()
+
+
+class StreamHub:
+    """Shares one rendered payload per key among every local viewer of that key.
+
+    loader(key, last_id) returns (row_id, payload_bytes) for the newest row after
+    last_id, or None. It runs once per notification per process, on whichever
+    viewer wakes first; the others reuse its result. Viewers can be threads
+    (wait) or asyncio tasks (wait_async) and share the same channels.
+    """
+
+    def __init__(self, channel, loader):
+        self.channel = channel
+        self._loader = loader
+        self._channels = {}
+        self._lock = threading.Lock()
+        # Context the loader needs when it runs off a request thread (set by asgi.py)
+        self.loader_context = nullcontext
+        self.loads = 0
+        notifier.subscribe(channel, self._on_notify)
+
+    def _on_notify(self, key):
+        ch = self._channels.get(str(key))
+        if ch is None:
+            return
+        with ch.cond:
+            ch.dirty = True
+            self._wake(ch)
+
+    def _wake(self, ch):
+        # Caller holds ch.cond
+        ch.cond.notify_all()
+        for loop, event in ch.async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    @contextmanager
+    def viewer(self, key):
+        key = str(key)
+        notifier.notifier.listen()
+        with self._lock:
+            ch = self._channels.get(key)
+            if ch is None:
+                ch = self._channels[key] = _Channel()
+            ch.viewers += 1
+        try:
+            yield ch
+        finally:
+            with self._lock:
+                ch.viewers -= 1
+                if ch.viewers == 0:
+                    self._channels.pop(key, None)
+
+    def _claim_refresh(self, ch):
+        # Caller holds ch.cond
+        if ch.dirty and not ch.refreshing:
+            ch.dirty = False
+            ch.refreshing = True
+            ch.checked_at = time.monotonic()
+            return True
+        return False
+
+    def _load(self, key, last_id):
+        with self.loader_context():
+            return self._loader(key, last_id)
+
+    def _finish_refresh(self, ch, result):
+        # Caller holds ch.cond
+        ch.refreshing = False
+        self.loads += 1
+        if result:
+            ch.latest_id, ch.payload = result
+        self._wake(ch)
+
+    def _expire(self, ch, timeout):
+        # Missed wake-ups are possible across processes; have the next wait
+        # re-check, unless another viewer already did so recently
+        if time.monotonic() - ch.checked_at >= timeout:
+            ch.dirty = True
+
+    def wait(self, key, ch, last_id, timeout=STREAM_RECHECK_INTERVAL):
+        """Block until a row newer than last_id is available; returns (id, payload) or None on timeout."""
+        deadline = time.monotonic() + timeout
+        with ch.cond:
+            while True:
+                if self._claim_refresh(ch):
+                    result = None
+                    ch.cond.release()
+                    try:
+                        result = self._load(key, ch.latest_id)
+                    except BaseException:
+                        ch.dirty = True
+                        raise
+                    finally:
+                        ch.cond.acquire()
+                        self._finish_refresh(ch, result)
+                    continue
+                if ch.latest_id > last_id and not ch.refreshing:
+                    return ch.latest_id, ch.payload
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._expire(ch, timeout)
+                    return None
+                ch.cond.wait(remaining)
+
+    async def wait_async(self, key, ch, last_id, timeout=STREAM_RECHECK_INTERVAL):
+        """asyncio counterpart of wait(); the loader runs in the default executor."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            event = None
+            with ch.cond:
+                claimed = self._claim_refresh(ch)
+                if not claimed:
+                    if ch.latest_id > last_id and not ch.refreshing:
+                        return ch.latest_id, ch.payload
+                    event = asyncio.Event()
+                    waiter = (loop, event)
+                    ch.async_waiters.add(waiter)
+            if claimed:
+                result = None
+                try:
+                    result = await loop.run_in_executor(None, self._load, key, ch.latest_id)
+                except BaseException:
+                    # Cancelled (client went away) or failed: leave the refresh to the next viewer
+                    ch.dirty = True
+                    raise
+                finally:
+                    with ch.cond:
+                        self._finish_refresh(ch, result)
+                continue
+            try:
+                await asyncio.wait_for(event.wait(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                with ch.cond:
+                    self._expire(ch, timeout)
+                return None
+            finally:
+                with ch.cond:
+                    ch.async_waiters.discard(waiter)
+
+    def stats(self):
+        return {'patients': len(self._channels), 'viewers': sum(c.viewers for c in list(self._channels.values())), 'loads': self.loads}
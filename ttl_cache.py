@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+import notifier
+
+
+class TTLCache:
+    """Per-key values loaded from the database, least recently used first out.
+
+    Subclasses implement _load(key). Entries are dropped by invalidate(), which
+    the owner subscribes to a notifier channel so a write in any worker reaches
+    every worker, and expire after ttl seconds as a fallback. A None from _load
+    (no such row) is returned but not stored.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _load(self, key):
+        raise NotImplementedError
+
+    def get(self, key):
+        # Notifier messages carry keys as strings
+        cache_key = str(key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        notifier.notifier.listen()
+        value = self._load(key)
+
+        with self._lock:
+            # Don't store a value read before an invalidation that raced with us
+            if value is not None and generation == self._generation:
+                self._entries[cache_key] = (now + self.ttl, value)
+                self._entries.move_to_end(cache_key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(key), None)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
@@ -0,0 +1,77 @@
+import re
+from db import get_db
+from pagination import decode_cursor, split_page
+from ttl_cache import TTLCache
+import notifier
+
+USER_CACHE_TTL = 300
+USER_CACHE_MAX_ENTRIES = 5000
+
+# Page sizes of the admin user search (typeahead)
+SEARCH_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+
+
+def username_key(username):
+    """Normalised form of a username: users.username_key is unique, so two accounts
+    can't differ only by case or surrounding spaces.
+    """
+    return username.strip().casefold()
+
+
+class UserProfileCache(TTLCache):
+    """(username, role, full_name) per user id, used to refresh sessions on every
+    request; dropped when the users row changes ('users' notifier channel).
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+
+    def _load(self, user_id):
+        """The user's profile dict, or None if the user no longer exists."""
+        row = get_db().execute("SELECT username, role, full_name FROM users WHERE id = ?", (user_id,)).fetchone()
+        return dict(row) if row else None
+
+
+user_cache = UserProfileCache()
+notifier.subscribe('users', user_cache.invalidate)
+
+
+def get_user_profile(user_id):
+    return user_cache.get(user_id)
+
+
+def invalidate_user(user_id):
+    """Call after committing a change to (or the deletion of) the user's users row."""
+    notifier.publish('users', user_id)
+
+
+def search_expression(query):
+    """FTS5 query matching every word of `query` as a word prefix; None when it has no words."""
+    words = re.findall(r'\w+', query.casefold())
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_users(conn, query='', roles=(), limit=SEARCH_LIMIT, cursor=None):
+    """A page of users whose name or username has words starting with those of
+    `query`, optionally limited to `roles`, ordered by name. Returns (rows, next_cursor).
+    """
+    where = []
+    params = []
+    expression = search_expression(query or '')
+    if expression:
+        where.append("u.id IN (SELECT rowid FROM users_search WHERE users_search MATCH ?)")
+        params.append(expression)
+    if roles:
+        where.append(f"u.role IN ({','.join('?' * len(roles))})")
+        params.extend(roles)
+    if cursor:
+        where.append("(u.full_name, u.id) > (?, ?)")
+        params.extend(decode_cursor(cursor, 2))
+    sql = "SELECT u.id, u.username, u.full_name, u.role FROM users u"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    rows = conn.execute(sql + " ORDER BY u.full_name, u.id LIMIT ?", params + [limit + 1]).fetchall()
+    return split_page(rows, limit, lambda row: (row['full_name'], row['id']))
@@ -0,0 +1,117 @@
+import math
+from db import READING_FIELDS
+import metrics
+import notifier
+import rollups
+from archive import reading_sources
+
+INSERT_READING_SQL = '''
+    INSERT INTO health_data (user_id, heart_rate, blood_pressure_sys, blood_pressure_dia, oxygen_level, temperature, sugar_level)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+MAX_BATCH_SIZE = 1000
+
+
+def _to_number(field, value):
+    if value is None or value == '':
+        return 0
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid {field}")
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid {field}")
+    if not isinstance(value, (int, float)) or (isinstance(value, float) and not math.isfinite(value)):
+        raise ValueError(f"Invalid {field}")
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def parse_reading(data):
+    """Validate one reading payload and return its row tuple for INSERT_READING_SQL.
+
+    Raises ValueError with a client-facing message when the payload is unusable.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Reading must be a JSON object')
+
+    user_id = data.get('user_id')
+    if user_id is None or user_id == '':
+        raise ValueError('Missing user_id')
+    # Like _to_number, but ids must be whole: True is not user 1 and 2.7 is not user 2
+    if isinstance(user_id, bool) or (isinstance(user_id, float) and not user_id.is_integer()):
+        raise ValueError('Invalid user_id')
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('Invalid user_id')
+    if user_id <= 0:
+        raise ValueError('Invalid user_id')
+
+    return (user_id,) + tuple(_to_number(field, data.get(field, 0)) for field in READING_FIELDS)
+
+
+def insert_readings(conn, rows):
+    """Insert already-validated reading rows and fold them into the rollups.
+
+    The caller owns the transaction.
+    """
+    if not rows:
+        return
+    conn.executemany(INSERT_READING_SQL, rows)
+    # AUTOINCREMENT ids of one write transaction are contiguous
+    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    rollups.update_rollups(conn, last_id - len(rows) + 1, last_id)
+    update_patient_latest(conn, last_id - len(rows) + 1, last_id)
+
+
+# patient_latest keeps each patient's newest reading (by timestamp, then id) so
+# dashboards and live streams never have to search health_data for it.
+_LATEST_COLUMNS = ', '.join(READING_FIELDS)
+_LATEST_UPDATE = ', '.join(f"{field} = excluded.{field}" for field in READING_FIELDS)
+
+_UPDATE_LATEST_SQL = f"""
+    INSERT INTO patient_latest (patient_id, reading_id, timestamp, {_LATEST_COLUMNS})
+    SELECT user_id, id, timestamp, {_LATEST_COLUMNS} FROM health_data
+    WHERE id IN (SELECT MAX(id) FROM health_data WHERE id BETWEEN ? AND ? GROUP BY user_id)
+    ON CONFLICT (patient_id) DO UPDATE SET
+        reading_id = excluded.reading_id, timestamp = excluded.timestamp, {_LATEST_UPDATE}
+    WHERE (excluded.timestamp, excluded.reading_id) > (patient_latest.timestamp, patient_latest.reading_id)
+"""
+
+
+def update_patient_latest(conn, first_id, last_id):
+    """Fold the health_data rows with ids first_id..last_id into patient_latest."""
+    conn.execute(_UPDATE_LATEST_SQL, (first_id, last_id))
+
+
+def rebuild_patient_latest(conn):
+    """Recompute patient_latest from health_data and its archive partitions (after bulk
+    loads or deletes). The caller commits; archived months are committed as they go.
+    """
+    conn.execute("DELETE FROM patient_latest")
+    for table, where, params in reading_sources(conn):
+        conn.execute(f"""
+            INSERT INTO patient_latest (patient_id, reading_id, timestamp, {_LATEST_COLUMNS})
+            SELECT user_id, id, timestamp, {_LATEST_COLUMNS} FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp DESC, id DESC) AS position
+                FROM {table} {'WHERE ' + where if where else ''}
+            )
+            WHERE position = 1
+            ON CONFLICT (patient_id) DO UPDATE SET
+                reading_id = excluded.reading_id, timestamp = excluded.timestamp, {_LATEST_UPDATE}
+            WHERE (excluded.timestamp, excluded.reading_id) > (patient_latest.timestamp, patient_latest.reading_id)
+        """, params)
+        if where:
+            # The partition can only be detached outside a transaction
+            conn.commit()
+
+
+def publish_readings(rows):
+    """Wake live viewers of every patient in rows. Call only after the rows are committed."""
+    metrics.registry.count_readings(len(rows))
+    for user_id in {row[0] for row in rows}:
+        notifier.publish('vitals', user_id)